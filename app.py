@@ -1,12 +1,23 @@
-from flask import Flask, request, render_template_string, send_file, jsonify, abort
-import os, time, math, json, re, subprocess, requests, cv2
+from flask import Flask, request, render_template_string, send_from_directory, jsonify, abort, Response
+import os, io, csv, sqlite3, time, math, json, re, subprocess, requests, importlib.util, threading, uuid, queue, random, hashlib, hmac, shutil, logging, heapq, itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait as wait_futures, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from dotenv import load_dotenv
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
 from datetime import datetime
 
 # ===== ENV =====
 load_dotenv()
 app = Flask(__name__)
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+log = logging.getLogger("ai-studio")
+
 BASE_URL = os.getenv("SORA_BASE_URL", "https://api.sora.openai.com/v1/videos")
 TOKEN    = os.getenv("SORA_TOKEN")
 HEADERS  = {"Authorization": f"Bearer {TOKEN}" if TOKEN else "", "Content-Type": "application/json"}
@@ -15,11 +26,91 @@ PLAN = os.getenv("PLAN", "PLUS").upper()   # PLUS | PRO
 CUT_SEC_OVERRIDE = os.getenv("CUT_SEC")    # 예: "20"
 DEFAULT_CUT_SEC  = 10 if PLAN == "PLUS" else 25
 FINAL_SCALE      = os.getenv("FINAL_SCALE", "").strip()
+VIDEO_PROBE      = os.getenv("VIDEO_PROBE", "ffprobe").strip().lower()   # ffprobe | cv2 — 해상도 읽는 방법
+
+SORA_POOL_SIZE = int(os.getenv("SORA_POOL_SIZE", "16"))     # keep-alive 커넥션 풀 크기
+SORA_RETRIES   = int(os.getenv("SORA_RETRIES", "5"))        # 일시 오류 재시도 횟수
+RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "120"))  # 서버가 준 Retry-After 상한(초)
+POLL_MIN_SEC   = float(os.getenv("POLL_MIN_SEC", "2"))
+POLL_MAX_SEC   = float(os.getenv("POLL_MAX_SEC", "20"))
+POLL_EXPECT_PER_SEC = float(os.getenv("POLL_EXPECT_PER_SEC", "6"))  # 영상 1초당 예상 생성 시간(초)
+GEN_TIMEOUT_FACTOR  = float(os.getenv("GEN_TIMEOUT_FACTOR", "10"))  # 예상 생성 시간의 이 배수를 넘기면 실패
+GEN_TIMEOUT_SEC     = float(os.getenv("GEN_TIMEOUT_SEC", "0"))      # 고정 상한(초). 0 이면 배수로 계산
+
+# Sora 제출 한도(PLAN 기본값, ENV 로 덮어쓰기): 분당 제출 수, 버스트, 동시 생성 수
+_PLAN_SUBMIT_LIMITS = {"PLUS": (10, 2, 2), "PRO": (30, 5, 5)}
+_rate, _burst, _inflight = _PLAN_SUBMIT_LIMITS.get(PLAN, _PLAN_SUBMIT_LIMITS["PLUS"])
+SUBMIT_RATE_PER_MIN = float(os.getenv("SUBMIT_RATE_PER_MIN", "0")) or _rate
+SUBMIT_BURST        = int(os.getenv("SUBMIT_BURST", "0")) or _burst
+SUBMIT_MAX_INFLIGHT = int(os.getenv("SUBMIT_MAX_INFLIGHT", "0")) or _inflight
+
+# off: 원본을 디스크에 받은 뒤 처리 | url: ffmpeg 가 URL 을 직접 읽음 | pipe: HTTP 본문을 ffmpeg stdin 으로
+STREAM_INPUT     = os.getenv("STREAM_INPUT", "off").strip().lower()
+RANGED_MIN_BYTES = int(os.getenv("RANGED_MIN_BYTES", str(64 << 20)))  # 이 크기 이상이면 분할 병렬 다운로드
+RANGED_PARTS     = int(os.getenv("RANGED_PARTS", "4"))                 # 0/1 이면 분할 다운로드 끔
+
+JOB_WORKERS   = int(os.getenv("JOB_WORKERS", "4"))      # 동시에 실행되는 생성 작업 수
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "32"))   # 실행 대기열 최대 길이(초과 시 503)
+JOB_TTL_SEC   = int(os.getenv("JOB_TTL_SEC", "86400"))  # 끝난 작업 상태 보관 시간
+
+JOURNAL_DB = os.getenv("JOURNAL_DB", "jobs.db").strip()   # 작업·컷 진행 저널(SQLite). 비우면 끔
+
+BATCH_MAX_ITEMS   = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_WORKERS     = int(os.getenv("BATCH_WORKERS", "0")) or max(1, JOB_WORKERS // 2)  # 배치 전용 작업 풀 크기
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "0")) or BATCH_WORKERS  # 배치 하나가 동시에 돌리는 작업 수
+BATCH_PRIORITY    = -1    # 배치 컷의 제출 우선순위 상한(대화형 기본 0 보다 뒤)
+PRIORITY_TOKEN    = os.getenv("PRIORITY_TOKEN", "").strip()   # X-Priority-Token 이 일치하는 요청만 priority > 0 허용
+
+PIPELINE_DEPTH   = int(os.getenv("PIPELINE_DEPTH", "4"))    # 단계 사이 대기열 크기
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))  # 작업당 다운로드 스레드
+POST_WORKERS     = int(os.getenv("POST_WORKERS", "2"))      # 작업당 후처리(워터마크) 스레드
+
+# 노드 전체 ffmpeg 인코딩 슬롯. 0 이면 코어 수 기준 자동
+CPU_COUNT      = os.cpu_count() or 1
+ENCODE_SLOTS   = int(os.getenv("ENCODE_SLOTS", "0")) or max(1, CPU_COUNT // 4)
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "0")) or max(1, CPU_COUNT // ENCODE_SLOTS)
+
+# single: 흐림·스티칭·스케일·BGM 을 한 번의 인코딩으로 | legacy: 컷별 흐림 후 재인코딩
+FINISH_MODE = os.getenv("FINISH_MODE", "single").strip().lower()
+WATERMARK_BLUR = os.getenv("WATERMARK_BLUR", "1") != "0"
+WM_DETECT        = os.getenv("WM_DETECT", "1") != "0"          # 여러 프레임에서 고정 오버레이 위치 탐지(OpenCV 필요)
+WM_SAMPLE_FRAMES = int(os.getenv("WM_SAMPLE_FRAMES", "8"))
+WM_STATIC_STD    = float(os.getenv("WM_STATIC_STD", "6"))       # 프레임 간 밝기 표준편차가 이보다 작으면 '고정'
+WM_EDGE_MIN      = float(os.getenv("WM_EDGE_MIN", "20"))        # 모든 샘플 프레임에서 이 이상의 윤곽이 있어야 오버레이
+WM_PAD           = int(os.getenv("WM_PAD", "6"))                # 탐지된 박스 여백(px)
+
+SCRATCH_DIR        = os.path.abspath(os.getenv("SCRATCH_DIR", "scratch"))  # 작업별 중간 파일(빠른 스크래치 볼륨 권장)
+OUTPUT_DIR         = os.path.abspath(os.getenv("OUTPUT_DIR", "outputs"))   # 최종 결과물 저장소
+KEEP_SCRATCH       = os.getenv("KEEP_SCRATCH", "0") == "1"   # 디버깅용: 끝난 작업 폴더를 남김
+OUTPUT_MAX_AGE_SEC = int(os.getenv("OUTPUT_MAX_AGE_SEC", str(7 * 86400)))
+OUTPUT_MAX_BYTES   = int(os.getenv("OUTPUT_MAX_BYTES", str(50 << 30)))
+GC_INTERVAL_SEC    = int(os.getenv("GC_INTERVAL_SEC", "600"))
+
+MEDIA_MAX_AGE   = int(os.getenv("MEDIA_MAX_AGE", "86400"))          # 결과물은 이름이 고유하므로 길게 캐시
+X_ACCEL_PREFIX  = os.getenv("X_ACCEL_PREFIX", "").rstrip("/")       # nginx internal location (예: /_outputs)
+
+CLIP_CACHE_DIR         = os.getenv("CLIP_CACHE_DIR", "clip_cache").strip()   # 비우면 캐시 끔
+CLIP_CACHE_MAX_BYTES   = int(os.getenv("CLIP_CACHE_MAX_BYTES", str(20 << 30)))
+CLIP_CACHE_MAX_ENTRIES = int(os.getenv("CLIP_CACHE_MAX_ENTRIES", "10000"))  # 파일 없이 video id 만 남긴 항목 포함
+
+HLS_PREVIEW        = os.getenv("HLS_PREVIEW", "1") != "0"      # 완성된 컷부터 HLS 로 미리보기 제공
+HLS_PREVIEW_HEIGHT = int(os.getenv("HLS_PREVIEW_HEIGHT", "720"))  # 미리보기 재인코딩 시 최대 세로 해상도(0 이면 원본)
+HLS_PREVIEW_CRF    = os.getenv("HLS_PREVIEW_CRF", "26")
+HLS_JS_URL = os.getenv("HLS_JS_URL", "https://cdn.jsdelivr.net/npm/hls.js@1.5.20/dist/hls.min.js")  # 고정 버전(자체 호스팅 경로도 가능)
+HLS_JS_SRI = os.getenv("HLS_JS_SRI", "").strip()   # 위 파일의 integrity 값(sha384-...). 비우면 검사 안 함
+
+BGM_CACHE_DIR       = os.getenv("BGM_CACHE_DIR", "bgm_cache").strip()      # 비우면 작업마다 새로 받음
+BGM_CACHE_MAX_BYTES = int(os.getenv("BGM_CACHE_MAX_BYTES", str(2 << 30)))
+BGM_REVALIDATE_SEC  = int(os.getenv("BGM_REVALIDATE_SEC", "3600"))          # 이 시간 안에는 ETag 재검증 생략
+AUDIO_RATE          = int(os.getenv("AUDIO_RATE", "48000"))                 # 최종 오디오 샘플레이트
 
 def resolve_cut_sec():
     """구독 플랜 기준 컷 길이 계산(오버라이드 우선)."""
     return int(CUT_SEC_OVERRIDE) if CUT_SEC_OVERRIDE else (10 if PLAN == "PLUS" else 25)
 
+for _d in (SCRATCH_DIR, OUTPUT_DIR):
+    os.makedirs(_d, exist_ok=True)
+
 # ===== HTML (자동 시나리오 생성: 입력 변경 시 디바운스 호출) =====
 HTML = """
 <!DOCTYPE html><html lang="ko"><head><meta charset="UTF-8" />
@@ -81,6 +172,17 @@ textarea{min-height:120px} button{margin-top:12px;padding:12px 16px;border:0;bor
       </div>
     </div>
 
+    <div class="grid2">
+      <div>
+        <label>생성 방식</label>
+        <select id="strategy">
+          <option value="chain" selected>연쇄 (직전 컷을 이어서 생성)</option>
+          <option value="anchored">앵커 (첫 컷 생성 후 나머지 동시 생성)</option>
+          <option value="parallel">병렬 (캐릭터 참조만으로 모든 컷 동시 생성)</option>
+        </select>
+      </div>
+    </div>
+
     <label>전역 프롬프트</label>
     <textarea id="global_prompt" placeholder="same main characters and lighting. cinematic realism."></textarea>
     <div class="row"><span class="small">입력 변경 시 자동으로 시나리오를 생성하여 아래 영역에 채웁니다.</span></div>
@@ -247,6 +349,7 @@ document.getElementById('generate').addEventListener('click', async ()=>{
     ratio: document.getElementById('ratio').value,
     lang: document.getElementById('lang').value,
     inherit: document.getElementById('inherit').value,
+    strategy: document.getElementById('strategy').value,
     voice: document.getElementById('voice').value,
     global_prompt: document.getElementById('global_prompt').value || '',
     scenario: (document.getElementById('scenario').value || '').split('\\n').filter(s=>s.trim().length>0),
@@ -257,47 +360,843 @@ document.getElementById('generate').addEventListener('click', async ()=>{
 
   const r = await fetch('/generate', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
   const data = await r.json();
-  if(data.status==='success'){
+  if(data.status!=='success'){ showStatus('오류: '+data.message, 'error'); return; }
+  showStatus('작업 대기 중... (job '+data.job_id+')', 'info');
+  watchJob(data);
+});
+
+// 작업 진행 상황 구독 (SSE)
+let previewHls = null, hlsLoading = null;
+function loadHls(){
+  // hls.js 는 미리보기가 필요할 때만 불러온다(고정 버전, HLS_JS_SRI 가 있으면 integrity 검사)
+  if(window.Hls) return Promise.resolve();
+  if(!hlsLoading) hlsLoading = new Promise((resolve, reject)=>{
+    const s = document.createElement('script');
+    s.src = {{ hls_js_url|tojson }};
+    const sri = {{ hls_js_sri|tojson }};
+    if(sri){ s.integrity = sri; s.crossOrigin = 'anonymous'; }
+    s.onload = resolve;
+    s.onerror = ()=>{ hlsLoading = null; reject(); };
+    document.head.appendChild(s);
+  });
+  return hlsLoading;
+}
+function showPreview(url){
+  // 첫 컷이 준비되면 진행 중인 재생목록을 재생 (Safari 는 기본 지원, 그 외 hls.js)
+  if(document.getElementById('preview')) return;
+  const box = document.getElementById('videoResult');
+  box.innerHTML = `<video id="preview" controls autoplay muted style="width:100%;border-radius:8px"></video>
+    <div class="small">미리보기 — 생성이 끝난 컷까지 재생됩니다</div>`;
+  box.style.display='block';
+  const v = document.getElementById('preview');
+  if(v.canPlayType('application/vnd.apple.mpegurl')){ v.src = url; }
+  else loadHls().then(()=>{
+    if(!Hls.isSupported() || document.getElementById('preview') !== v) return;   // 그사이 결과 화면으로 바뀌었으면 건너뜀
+    previewHls = new Hls(); previewHls.loadSource(url); previewHls.attachMedia(v);
+  }).catch(()=>{});
+}
+
+function showResult(filename){
+  if(previewHls){ previewHls.destroy(); previewHls = null; }
+  const box = document.getElementById('videoResult');
+  box.innerHTML = `
+    <video controls autoplay style="width:100%;border-radius:8px">
+      <source src="/media/${filename}" type="video/mp4">
+    </video>
+    <div class="row"><a href="/download/${filename}" download><button>💾 다운로드</button></a></div>`;
+  box.style.display='block';
+}
+
+function watchJob(job){
+  const es = new EventSource(job.events_url);
+  es.addEventListener('started', ()=>showStatus('생성 시작', 'info'));
+  es.addEventListener('clip_queued', e=>{ const d=JSON.parse(e.data); showStatus(`컷 ${d.clip} 제출 대기 중... (예상 시작 ${new Date(d.eta*1000).toLocaleTimeString()})`, 'info'); });
+  es.addEventListener('clip_submitted', e=>{ const d=JSON.parse(e.data); showStatus(`컷 ${d.clip} 생성 중...`, 'info'); });
+  es.addEventListener('preview', e=>showPreview(JSON.parse(e.data).url));
+  es.addEventListener('clip_done', e=>{ const d=JSON.parse(e.data); showStatus(`컷 ${d.done}/${d.total} 완료`, 'info'); });
+  es.addEventListener('stage', e=>{ const d=JSON.parse(e.data); showStatus(d.stage==='bgm' ? 'BGM 준비 중...' : d.stage==='finish' ? '최종 인코딩 중...' : '스티칭 중...', 'info'); });
+  es.addEventListener('completed', e=>{ es.close(); showResult(JSON.parse(e.data).filename); showStatus('생성 완료', 'success'); });
+  es.addEventListener('failed', e=>{
+    es.close(); showStatus('오류: '+JSON.parse(e.data).error, 'error');
+    if(previewHls){ previewHls.destroy(); previewHls = null; }
     const box = document.getElementById('videoResult');
-    box.innerHTML = `
-      <video controls autoplay style="width:100%;border-radius:8px">
-        <source src="/download/${data.filename}" type="video/mp4">
-      </video>
-      <div class="row"><a href="/download/${data.filename}" download><button>💾 다운로드</button></a></div>`;
+    box.innerHTML = `<div class="row"><button id="resume">↻ 이어서 생성</button></div>`;
     box.style.display='block';
-    showStatus('생성 완료', 'success');
-  }else{
-    showStatus('오류: '+data.message, 'error');
-  }
-});
+    document.getElementById('resume').addEventListener('click', ()=>resumeJob(job.job_id));
+  });
+}
+
+// 실패한 작업 이어서 생성 (캐시된 컷은 건너뜀)
+async function resumeJob(jobId){
+  const r = await fetch(`/jobs/${jobId}/resume`, {method:'POST'});
+  const data = await r.json();
+  if(data.status!=='success'){ showStatus('오류: '+data.message, 'error'); return; }
+  document.getElementById('videoResult').style.display='none';
+  showStatus(`컷 ${data.resume_from}부터 이어서 생성합니다`, 'info');
+  watchJob(data);
+}
 </script>
 </body></html>
 """
 
-# ===== 워터마크 흐림 =====
-def blur_watermark(input_path: str, output_path: str):
-    cap = cv2.VideoCapture(input_path)
+# ===== 계측 / 메트릭 =====
+_SEC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+STAGE_SECONDS  = Histogram("aistudio_stage_seconds", "파이프라인 단계별 소요 시간", ["stage"], buckets=_SEC_BUCKETS)
+POLL_SECONDS   = Histogram("aistudio_sora_poll_seconds", "Sora 상태 조회 1회 소요 시간", buckets=_SEC_BUCKETS)
+POLLS_TOTAL    = Counter("aistudio_sora_polls_total", "Sora 상태 조회 횟수", ["status"])
+DOWNLOAD_BYTES = Counter("aistudio_download_bytes_total", "다운로드한 바이트 수", ["kind"])
+DOWNLOAD_BPS   = Histogram("aistudio_download_bytes_per_second", "다운로드 처리량",
+                           buckets=(1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9))
+CLIPS_TOTAL    = Counter("aistudio_clips_total", "처리된 컷 수", ["source"])
+JOBS_TOTAL     = Counter("aistudio_jobs_total", "종료된 작업 수", ["state"])
+FFMPEG_CPU     = Counter("aistudio_ffmpeg_cpu_seconds_total", "ffmpeg 자식 프로세스 CPU 시간")
+ENCODE_WAIT    = Histogram("aistudio_encode_wait_seconds", "인코딩 슬롯 대기 시간", ["kind"], buckets=_SEC_BUCKETS)
+BGM_TOTAL      = Counter("aistudio_bgm_total", "BGM 준비 결과", ["result"])
+
+def log_event(event: str, **fields):
+    """구조화 로그 한 줄(JSON)."""
+    log.info(json.dumps({"ts": round(time.time(), 3), "event": event,
+                         **{k: v for k, v in fields.items() if v is not None}}, ensure_ascii=False))
+
+# ===== ffmpeg / 메타데이터 =====
+def is_url(src: str):
+    return src.startswith(("http://", "https://"))
+
+_CTX = threading.local()   # 현재 스레드가 처리 중인 작업 (Job.stage 가 설정, ffmpeg CPU 집계용)
+
+class EncodeScheduler:
+    """노드 전체 ffmpeg 인코딩 슬롯. 동시에 도는 인코더 수를 제한해 코어 경합을 막는다.
+
+    대기 순서는 우선순위(작을수록 먼저) → 도착 순. 짧은 컷 단위 인코딩이
+    긴 최종 인코딩보다 먼저 슬롯을 받는다.
+    """
+    PRIORITY = {"clip": 0, "preview": 1, "final": 2}
+
+    def __init__(self, slots: int = ENCODE_SLOTS, threads: int = ENCODE_THREADS):
+        self.slots = slots
+        self.threads = threads
+        self.busy = 0
+        self.waiting = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.wait_total = {}
+
+    def acquire(self, kind: str):
+        ticket = (self.PRIORITY.get(kind, self.PRIORITY["final"]), next(self.seq))
+        t0 = time.perf_counter()
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            while self.busy >= self.slots or self.waiting[0] != ticket:
+                self.cond.wait()
+            heapq.heappop(self.waiting)
+            self.busy += 1
+            self.cond.notify_all()
+            dt = time.perf_counter() - t0
+            self.wait_total[kind] = self.wait_total.get(kind, 0.0) + dt
+        ENCODE_WAIT.labels(kind).observe(dt)
+
+    def release(self):
+        with self.cond:
+            self.busy -= 1
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {"slots": self.slots, "threads_per_encode": self.threads, "busy": self.busy,
+                    "queued": len(self.waiting),
+                    "queued_by_kind": {k: sum(1 for p, _ in self.waiting if p == v) for k, v in self.PRIORITY.items()},
+                    "wait_sec_total": {k: round(v, 3) for k, v in self.wait_total.items()}}
+
+ENCODER = EncodeScheduler()
+
+def run_ffmpeg(cmd: list, feed_url: str = None, encode: str = None):
+    """ffmpeg 실행. encode("clip"|"preview"|"final")가 있으면 인코딩 슬롯을 받고 스레드 예산을 적용한다.
+
+    스트림 복사처럼 가벼운 작업은 encode 없이 바로 실행한다.
+    """
+    if not encode:
+        _exec_ffmpeg(cmd, feed_url)
+        return
+    # 스레드 예산: 필터 그래프와 출력 인코더 모두 ENCODE_THREADS 로 제한
+    cmd = [cmd[0], "-filter_complex_threads", str(ENCODER.threads)] + cmd[1:-1] + ["-threads", str(ENCODER.threads), cmd[-1]]
+    job = getattr(_CTX, "job", None)
+    with job.stage("encode_wait") if job else nullcontext():
+        ENCODER.acquire(encode)
+    try:
+        _exec_ffmpeg(cmd, feed_url)
+    finally:
+        ENCODER.release()
+
+def _exec_ffmpeg(cmd: list, feed_url: str = None):
+    """feed_url 이 있으면 HTTP 본문을 받아 그대로 stdin(pipe:0)에 흘려 넣는다.
+
+    자식 프로세스의 CPU 시간(user+sys)을 wait4 로 받아 현재 작업에 더한다.
+    """
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if feed_url else None)
+    try:
+        if feed_url:
+            with SORA.request("GET", feed_url, session=SORA.dl, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(1<<20):
+                    proc.stdin.write(chunk)
+    except BrokenPipeError:
+        pass   # ffmpeg 가 먼저 종료 — 아래 종료 코드로 판단
+    finally:
+        if proc.stdin:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        cpu = ru.ru_utime + ru.ru_stime
+        FFMPEG_CPU.inc(cpu)
+        job = getattr(_CTX, "job", None)
+        if job is not None:
+            job.add_ffmpeg_cpu(cpu)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+def probe_size(src: str):
+    """ffprobe 로 스트림 메타데이터에서 (w, h) 를 읽는다. URL 이면 헤더 부분만 받는다."""
+    out = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height", "-of", "json", src
+    ], check=True, capture_output=True, text=True).stdout
+    streams = json.loads(out).get("streams") or []
+    if not streams:
+        raise RuntimeError(f"비디오 스트림 없음: {src}")
+    return int(streams[0]["width"]), int(streams[0]["height"])
+
+def probe_audio(path: str):
+    """(오디오 스트림 유무, 길이 초). ffprobe 가 없는 환경(VIDEO_PROBE=cv2)에서는 ffmpeg 입력 정보로 판단."""
+    if VIDEO_PROBE != "cv2":
+        out = subprocess.run([
+            "ffprobe", "-v", "error", "-show_entries", "stream=codec_type:format=duration", "-of", "json", path
+        ], check=True, capture_output=True, text=True).stdout
+        info = json.loads(out)
+        audio = any(st.get("codec_type") == "audio" for st in info.get("streams") or [])
+        return audio, float((info.get("format") or {}).get("duration") or 0)
+    err = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True).stderr
+    m = re.search(r"Duration: (\d+):(\d+):([\d.]+)", err)
+    dur = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3)) if m else 0.0
+    return re.search(r"Stream #\S+.*: Audio:", err) is not None, dur
+
+# OpenCV·numpy 는 워터마크 탐지(또는 VIDEO_PROBE=cv2)에서만 쓰므로 기동 시 불러오지 않는다
+HAS_CV = all(importlib.util.find_spec(m) is not None for m in ("cv2", "numpy"))
+_CV = None
+
+def _cv():
+    """(cv2, numpy) 를 처음 필요할 때 불러온다."""
+    global _CV
+    if _CV is None:
+        import cv2, numpy
+        _CV = (cv2, numpy)
+    return _CV
+
+def video_size(path: str):
+    """(w, h). 기본은 ffprobe 메타데이터, VIDEO_PROBE=cv2 면 로컬 파일의 첫 프레임을 디코딩."""
+    if VIDEO_PROBE != "cv2" or is_url(path) or STREAM_INPUT != "off":
+        return probe_size(path)
+    cv2, _ = _cv()
+    cap = cv2.VideoCapture(path)
     ret, frame = cap.read()
     cap.release()
     if not ret:
-        raise RuntimeError(f"비디오 읽기 실패: {input_path}")
+        raise RuntimeError(f"비디오 읽기 실패: {path}")
     h, w = frame.shape[:2]
-    wm_x1, wm_y1 = int(w * 0.70), int(h * 0.85)
-    wm_x2, wm_y2 = int(w * 0.98), int(h * 0.98)
-    subprocess.run([
-        "ffmpeg", "-y", "-i", input_path,
-        "-filter_complex",
-        f"[0:v]crop={wm_x2-wm_x1}:{wm_y2-wm_y1}:{wm_x1}:{wm_y1},boxblur=20[wm];"
-        f"[0:v][wm]overlay={wm_x1}:{wm_y1}:enable='between(t,0,1e9)'",
+    return w, h
+
+# ===== 워터마크 흐림 =====
+_FALLBACK_BOX = (0.70, 0.85, 0.98, 0.98)   # 탐지 실패 시 쓰는 고정 박스(비율)
+_SEARCH_BOX   = (0.45, 0.65)               # 오버레이 탐색 범위: 이 비율 지점부터 우하단 끝까지
+_WM_DETECT_TRIES = 3                       # 같은 해상도에서 연속 실패하면 고정 박스를 캐시
+_WM_CONFIRM      = 2                       # 같은 박스가 이 수의 컷에서 탐지되어야 캐시
+
+_REGIONS = {}          # (w, h, ratio) → 흐림 박스. 이후 컷은 탐지를 건너뛴다
+_REGION_MISSES = {}
+_REGION_VOTES = {}     # (w, h, ratio) → (후보 박스, 연속 일치 수)
+_REGIONS_LOCK = threading.Lock()
+# 확정된 탐지 박스는 클립 캐시 옆에 저장해 재시작 후에도 첫 컷부터 작은 박스를 쓴다
+_REGIONS_FILE = os.path.join(os.path.abspath(CLIP_CACHE_DIR), "watermark_regions.json") if CLIP_CACHE_DIR else None
+
+def _load_regions():
+    if not _REGIONS_FILE:
+        return
+    try:
+        with open(_REGIONS_FILE, encoding="utf-8") as f:
+            for ent in json.load(f):
+                _REGIONS[(ent["w"], ent["h"], ent["ratio"])] = tuple(ent["region"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+def _save_regions():
+    """고정 박스가 아닌(탐지로 확정된) 박스만 기록한다. _REGIONS_LOCK 안에서 부른다."""
+    if not _REGIONS_FILE:
+        return
+    rows = [{"w": w, "h": h, "ratio": ratio, "region": list(box)}
+            for (w, h, ratio), box in _REGIONS.items() if box != fallback_box(w, h)]
+    try:
+        os.makedirs(os.path.dirname(_REGIONS_FILE), exist_ok=True)
+        with open(_REGIONS_FILE + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        os.replace(_REGIONS_FILE + ".tmp", _REGIONS_FILE)
+    except OSError as e:
+        log_event("watermark_regions_save_failed", error=str(e))
+
+def fallback_box(w: int, h: int):
+    return (int(w * _FALLBACK_BOX[0]), int(h * _FALLBACK_BOX[1]),
+            int(w * _FALLBACK_BOX[2]), int(h * _FALLBACK_BOX[3]))
+
+def _box_overlap(a, b):
+    """두 박스의 교집합 넓이."""
+    return max(0, min(a[2], b[2]) - max(a[0], b[0])) * max(0, min(a[3], b[3]) - max(a[1], b[1]))
+
+def _same_box(a, b, iou: float = 0.5):
+    inter = _box_overlap(a, b)
+    union = (a[2]-a[0]) * (a[3]-a[1]) + (b[2]-b[0]) * (b[3]-b[1]) - inter
+    return union > 0 and inter / union >= iou
+
+def sample_frames(src: str, n: int):
+    """영상 전체에 고르게 n 프레임을 뽑아 그레이스케일로 반환."""
+    cv2, np = _cv()
+    cap = cv2.VideoCapture(src)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    frames = []
+    try:
+        for idx in (np.linspace(0, total - 1, n).astype(int) if total > n else range(n)):
+            if total > n:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    finally:
+        cap.release()
+    return frames
+
+def detect_watermark(src: str, w: int, h: int):
+    """샘플 프레임에서 '프레임 간 변화가 없고 모든 프레임에 윤곽이 있는' 영역을 찾아 박스로 반환.
+
+    알려진 워터마크 위치(고정 박스) 안에 대부분 들어오는 후보만 받는다. 장면 속 정지 물체를 흐리지 않기 위함.
+    장면 자체가 정지해 있어 후보가 지나치게 크거나, 겹치는 후보가 없으면 None.
+    """
+    frames = sample_frames(src, WM_SAMPLE_FRAMES)
+    if len(frames) < 3:
+        return None
+    cv2, np = _cv()
+    sx, sy = int(w * _SEARCH_BOX[0]), int(h * _SEARCH_BOX[1])
+    stack = np.stack([f[sy:, sx:] for f in frames]).astype(np.float32)     # (n, H, W)
+    static = stack.std(axis=0) < WM_STATIC_STD
+    edges = np.stack([np.abs(cv2.Laplacian(f, cv2.CV_32F)) for f in stack]).min(axis=0) > WM_EDGE_MIN
+    mask = cv2.dilate((static & edges).astype(np.uint8), np.ones((9, 9), np.uint8))   # 글자 사이 틈 메우기
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    zone = fallback_box(w, h)
+    cands = [tuple(int(v) for v in st) for st in stats[1:n]]
+    # 박스의 절반 이상이 고정 박스 안에 있어야 워터마크 후보
+    cands = [c for c in cands if _box_overlap((sx + c[0], sy + c[1], sx + c[0] + c[2], sy + c[1] + c[3]), zone) >= 0.5 * c[2] * c[3]]
+    if not cands:
+        return None
+    x, y, bw, bh, area = max(cands, key=lambda c: c[4])
+    if area < 0.0005 * w * h or bw * bh > 0.6 * mask.size:
+        return None
+    x1, y1 = max(0, sx + x - WM_PAD) & ~1, max(0, sy + y - WM_PAD) & ~1
+    x2, y2 = min(w, sx + x + bw + WM_PAD + 1) & ~1, min(h, sy + y + bh + WM_PAD + 1) & ~1
+    return (x1, y1, x2, y2) if x2 > x1 and y2 > y1 else None
+
+def watermark_region(w: int, h: int, src: str = None, ratio: str = None):
+    """흐림 영역 (x1, y1, x2, y2). 흐림이 필요 없으면 None.
+
+    src 가 있으면 (w, h, ratio) 별 캐시를 먼저 보고, 없을 때만 다중 프레임 탐지를 한다.
+    탐지 결과는 _WM_CONFIRM 개 컷에서 같은 박스가 나와야 캐시(및 파일 저장)하고, 그 전까지는 고정 박스와
+    합친 박스로 흐린다. 후보는 고정 박스 안에 절반 이상 걸친 것만 받으므로 고정 박스에서 크게 벗어난
+    위치의 워터마크는 찾지 못한다(그때는 고정 박스로 흐림).
+    src 가 URL(STREAM_INPUT=url|pipe)이면 원격을 다시 읽지 않도록 탐지하지 않고 캐시된 박스나 고정 박스를 쓴다.
+    """
+    if not WATERMARK_BLUR:
+        return None
+    fallback = fallback_box(w, h)
+    if not WM_DETECT or not HAS_CV or src is None:
+        return fallback
+    key = (w, h, ratio)
+    with _REGIONS_LOCK:
+        if key in _REGIONS:
+            return _REGIONS[key]
+    if is_url(src):
+        return fallback
+    try:
+        region = detect_watermark(src, w, h)
+    except Exception:
+        region = None
+    confirmed = False
+    with _REGIONS_LOCK:
+        if region:
+            prev, votes = _REGION_VOTES.get(key, (None, 0))
+            votes = votes + 1 if prev and _same_box(prev, region) else 1
+            _REGION_VOTES[key] = (region, votes)
+            if votes >= _WM_CONFIRM:
+                _REGIONS[key] = region
+                confirmed = True
+                _save_regions()
+        else:
+            _REGION_MISSES[key] = _REGION_MISSES.get(key, 0) + 1
+            if _REGION_MISSES[key] >= _WM_DETECT_TRIES:
+                _REGIONS[key] = fallback
+    if region and not confirmed:
+        # 아직 한 컷에서만 본 박스 — 고정 박스까지 덮어 워터마크를 놓치지 않는다
+        region = (min(region[0], fallback[0]), min(region[1], fallback[1]),
+                  max(region[2], fallback[2]), max(region[3], fallback[3]))
+    log_event("watermark_region", w=w, h=h, ratio=ratio, region=list(region or fallback),
+              detected=bool(region), confirmed=confirmed)
+    return region or fallback
+
+_load_regions()
+
+def blur_filter(src: str, region, out: str = ""):
+    """src 비디오 라벨에 region 흐림을 씌우는 filtergraph 조각."""
+    x1, y1, x2, y2 = region
+    tag = src.strip("[]").replace(":", "_")
+    return (f"{src}crop={x2-x1}:{y2-y1}:{x1}:{y1},boxblur=20[wm{tag}];"
+            f"{src}[wm{tag}]overlay={x1}:{y1}:enable='between(t,0,1e9)'{out}")
+
+def blur_watermark(input_path: str, output_path: str, ratio: str = None):
+    """input_path 는 로컬 파일 또는 URL. STREAM_INPUT=pipe 면 URL 본문을 stdin 으로 넣는다."""
+    region = watermark_region(*video_size(input_path), src=input_path, ratio=ratio)
+    feed = input_path if STREAM_INPUT == "pipe" and is_url(input_path) else None
+    src = "pipe:0" if feed else input_path
+    if region is None:
+        run_ffmpeg(["ffmpeg", "-y", "-i", src, "-c", "copy", output_path], feed_url=feed)
+        return
+    run_ffmpeg([
+        "ffmpeg", "-y", "-i", src,
+        "-filter_complex", blur_filter("[0:v]", region),
         "-c:a", "copy", output_path
-    ], check=True)
+    ], feed_url=feed, encode="clip")
+
+def prepare_clip(raw: str, done: str, ratio: str = None):
+    """후처리 단계. legacy 는 여기서 흐림까지, single 은 흐림 영역만 계산해 최종 인코딩에 넘긴다.
+
+    legacy + STREAM_INPUT 이면 raw 는 다운로드 URL 이며 원본은 디스크에 쓰지 않는다.
+    """
+    if FINISH_MODE == "legacy":
+        blur_watermark(raw, done, ratio)
+        if not is_url(raw):
+            os.remove(raw)
+        return {"path": done, "blur": None}
+    region = watermark_region(*video_size(raw), src=raw, ratio=ratio)
+    os.replace(raw, done)
+    return {"path": done, "blur": region}
 
 # ===== Sora 호출 =====
-def create_clip(prompt_text: str, ratio: str, cut_sec: int,
-                characters: list, global_voice: str, global_lang: str,
-                global_prompt: str = "", remix_id=None, ref_url=None, inherit="strong"):
-    if not TOKEN:
-        abort(500, description="SORA_TOKEN is not set")
+class RateLimited(Exception):
+    """Sora 가 429 로 거절. retry_after 초 뒤에 다시 제출해야 한다."""
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class SoraClient:
+    """Sora API 클라이언트. keep-alive 커넥션 풀 + Retry-After 를 따르는 재시도."""
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(self, base_url: str, headers: dict, pool_size: int = SORA_POOL_SIZE, retries: int = SORA_RETRIES):
+        self.base_url = base_url
+        self.retries = retries
+        self.api = self._session(pool_size)
+        self.api.headers.update(headers)
+        self.dl = self._session(pool_size)   # 다운로드 URL(CDN)에는 인증 헤더를 보내지 않는다
+
+    @staticmethod
+    def _session(pool_size: int):
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    @staticmethod
+    def _backoff(r, attempt: int):
+        """Retry-After 가 있으면 그 값(RETRY_AFTER_MAX 까지), 없으면 지터를 섞은 지수 백오프."""
+        ra = r.headers.get("Retry-After") if r is not None else None
+        if ra:
+            try:
+                return min(RETRY_AFTER_MAX, max(0.0, float(ra)))
+            except ValueError:
+                try:
+                    return min(RETRY_AFTER_MAX, max(0.0, parsedate_to_datetime(ra).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def request(self, method: str, url: str, idempotent: bool = True, session=None, retry_429: bool = True,
+                retries: int = None, **kw):
+        """429 는 retry_429 일 때, 5xx·네트워크 오류는 멱등 요청일 때만 재시도. retries=0 이면 한 번만 보낸다."""
+        session = session or self.api
+        retries = self.retries if retries is None else retries
+        kw.setdefault("timeout", 60)
+        # 비멱등 요청은 서버에 닿지 않은 것이 확실한 연결 실패만 재시도
+        retry_exc = requests.RequestException if idempotent else requests.ConnectTimeout
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            try:
+                r = session.request(method, url, **kw)
+            except retry_exc:
+                if last:
+                    raise
+                time.sleep(self._backoff(None, attempt))
+                continue
+            if last or not ((retry_429 and r.status_code == 429) or (idempotent and r.status_code in self.RETRY_STATUS)):
+                return r
+            r.close()
+            time.sleep(self._backoff(r, attempt))
+
+    def create(self, body: dict, retry_429: bool = True):
+        """생성 요청. retry_429=False 면 429 를 재시도하지 않고 RateLimited 로 올린다."""
+        r = self.request("POST", self.base_url, idempotent=False, retry_429=retry_429, json=body)
+        if r.status_code == 429 and not retry_429:
+            raise RateLimited(self._backoff(r, 0))
+        if r.status_code >= 400:
+            abort(r.status_code, description=r.text)
+        return r.json()["id"]
+
+    def status(self, video_id: str, retries: int = None, retry_429: bool = True):
+        """상태 조회. retry_429=False 면 429 를 RateLimited 로 올린다."""
+        r = self.request("GET", f"{self.base_url}/{video_id}", retries=retries, retry_429=retry_429)
+        if r.status_code == 429 and not retry_429:
+            raise RateLimited(self._backoff(r, 0))
+        if r.status_code >= 400:
+            abort(r.status_code, description=r.text)
+        return r.json()
+
+    def download(self, url: str, path: str):
+        """큰 파일이고 서버가 Range 를 지원하면 분할 병렬로, 아니면 한 번에 스트리밍으로 받는다. 받은 바이트 수를 반환."""
+        if RANGED_PARTS > 1:
+            h = self.request("HEAD", url, session=self.dl, allow_redirects=True)
+            size = int(h.headers.get("Content-Length") or 0)
+            if h.ok and h.headers.get("Accept-Ranges") == "bytes" and size >= RANGED_MIN_BYTES:
+                self._download_ranged(h.url, path, size)
+                return size
+        with self.request("GET", url, session=self.dl, stream=True) as r:
+            r.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in r.iter_content(1<<20):
+                    f.write(chunk)
+        return os.path.getsize(path)
+
+    def _download_ranged(self, url: str, path: str, size: int):
+        with open(path, "wb") as f:
+            f.truncate(size)
+        step = math.ceil(size / RANGED_PARTS)
+
+        def part(start: int):
+            end = min(size, start + step) - 1
+            with self.request("GET", url, session=self.dl, stream=True,
+                              headers={"Range": f"bytes={start}-{end}"}) as r:
+                if r.status_code != 206:
+                    raise RuntimeError(f"Range 요청 실패({r.status_code}): {url}")
+                with open(path, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(1<<20):
+                        f.write(chunk)
+
+        with ThreadPoolExecutor(max_workers=RANGED_PARTS) as ex:
+            for fut in [ex.submit(part, off) for off in range(0, size, step)]:
+                fut.result()
+
+class StatusPoller:
+    """여러 video id 를 하나의 루프에서 추적하는 공유 폴러.
+
+    id 마다 다음 조회 시각을 따로 두고, 처음엔 짧게(빠른 실패·즉시 완료 확인),
+    예상 생성 시간에 가까워질수록 촘촘히, 예상을 넘기면 점점 길게 조회한다.
+    조회는 한 번씩만 보내고, 429·5xx·네트워크 오류는 루프 안에서 잠들지 않고
+    그 id 의 다음 조회 시각을 백오프만큼 미룬다(연속 SORA_RETRIES 회를 넘기면 실패).
+    최대 대기 시간(GEN_TIMEOUT_SEC, 없으면 예상의 GEN_TIMEOUT_FACTOR 배)을 넘기면 TimeoutError 로 끝낸다.
+    """
+    def __init__(self, client: SoraClient):
+        self.client = client
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.tracked = {}
+        self.thread = None
+
+    def track(self, video_id: str, duration_sec: int = 0, **tags) -> Future:
+        """tags(job, clip 등)는 조회 로그에 함께 기록된다."""
+        with self.lock:
+            if video_id in self.tracked:
+                return self.tracked[video_id]["future"]
+            now = time.time()
+            expected = max(POLL_MIN_SEC, duration_sec * POLL_EXPECT_PER_SEC)
+            ent = {"future": Future(), "start": now, "next": now + POLL_MIN_SEC, "polls": 0, "errors": 0, "tags": tags,
+                   "expected": expected, "deadline": now + (GEN_TIMEOUT_SEC or expected * GEN_TIMEOUT_FACTOR)}
+            self.tracked[video_id] = ent
+            if self.thread is None or not self.thread.is_alive():
+                # fork 이후(gunicorn 등)에도 동작하도록 첫 사용 시 시작
+                self.thread = threading.Thread(target=self._loop, name="sora-poller", daemon=True)
+                self.thread.start()
+        self.wake.set()
+        return ent["future"]
+
+    @staticmethod
+    def _interval(elapsed: float, expected: float):
+        if elapsed < POLL_MIN_SEC * 3:
+            iv = POLL_MIN_SEC
+        elif elapsed < expected:
+            iv = (expected - elapsed) / 3
+        else:
+            iv = POLL_MIN_SEC + (elapsed - expected) / 4
+        return min(POLL_MAX_SEC, max(POLL_MIN_SEC, iv)) * random.uniform(0.9, 1.1)
+
+    def _poll(self, video_id: str, ent: dict):
+        """한 번 조회한다. 일시 오류면 다음 조회까지 기다릴 초를, 아니면 None 을 반환."""
+        t0, st, retry = time.perf_counter(), "error", None
+        try:
+            try:
+                j = self.client.status(video_id, retries=0, retry_429=False)
+            except RateLimited as e:
+                st, retry = "rate_limited", e.retry_after
+            except requests.RequestException:
+                retry = SoraClient._backoff(None, ent["errors"])
+            except HTTPException as e:
+                if e.code not in SoraClient.RETRY_STATUS:
+                    raise
+                retry = SoraClient._backoff(None, ent["errors"])
+            if retry is not None:
+                ent["errors"] += 1
+                if ent["errors"] > self.client.retries:
+                    raise RuntimeError(f"status polling for {video_id} failed {ent['errors']} times in a row ({st})")
+                return retry
+            ent["errors"] = 0
+            st = j.get("status") or "unknown"
+            if st == "completed":
+                ent["future"].set_result(j.get("download_url") or j.get("output_url"))
+            elif st == "failed":
+                abort(500, description=f"Generation failed: {j}")
+        except Exception as e:
+            ent["future"].set_exception(e)
+        finally:
+            dt = time.perf_counter() - t0
+            ent["polls"] += 1
+            POLL_SECONDS.observe(dt)
+            POLLS_TOTAL.labels(st).inc()
+            log_event("sora_poll", video_id=video_id, status=st, sec=round(dt, 3), poll=ent["polls"],
+                      elapsed=round(time.time() - ent["start"], 1), **ent["tags"])
+
+    def _loop(self):
+        while True:
+            self.wake.clear()
+            with self.lock:
+                now = time.time()
+                late = [(vid, ent) for vid, ent in self.tracked.items() if ent["deadline"] <= now]
+                due = [(vid, ent) for vid, ent in self.tracked.items() if ent["next"] <= now < ent["deadline"]]
+            for vid, ent in late:
+                waited = now - ent["start"]
+                log_event("sora_poll_timeout", video_id=vid, sec=round(waited, 1), polls=ent["polls"], **ent["tags"])
+                ent["future"].set_exception(TimeoutError(f"generation of {vid} did not finish within {waited:.0f}s"))
+            for vid, ent in due:
+                retry = self._poll(vid, ent)
+                now = time.time()
+                ent["next"] = now + (retry if retry is not None else self._interval(now - ent["start"], ent["expected"]))
+            with self.lock:
+                for vid in [v for v, ent in self.tracked.items() if ent["future"].done()]:
+                    del self.tracked[vid]
+                nxt = min((min(ent["next"], ent["deadline"]) for ent in self.tracked.values()), default=None)
+            self.wake.wait(timeout=None if nxt is None else max(0.0, nxt - time.time()))
+
+class SubmitScheduler:
+    """모든 클립 생성 제출이 거치는 스케줄러.
+
+    토큰 버킷(분당 제출 수·버스트)과 동시 생성 한도를 지키며, 우선순위가 높은 대기열부터,
+    같은 우선순위 안에서는 사용자별 라운드로빈으로 하나씩 제출한다. 429 를 받으면
+    Retry-After 동안 전체 제출을 멈추고 그 컷을 맨 앞에 다시 넣는다(작업을 실패시키지 않음).
+    동시 생성 슬롯은 폴러가 해당 video id 의 완료/실패를 확인할 때 반납된다.
+    같은 key(요청 본문)가 대기 중이거나 생성 중이면 새로 제출하지 않고 그 결과를 함께 쓴다(single-flight).
+    """
+    def __init__(self, poller: StatusPoller, rate_per_min: float = SUBMIT_RATE_PER_MIN,
+                 burst: int = SUBMIT_BURST, max_inflight: int = SUBMIT_MAX_INFLIGHT):
+        self.poller = poller
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.paused_until = 0.0
+        self.queues = {}             # priority → {user: deque[ticket]} (dict 순서 = 라운드로빈 순서)
+        self.flights = {}            # key → 대기 중이거나 생성 중인 ticket
+        self.cond = threading.Condition()
+        self.thread = None
+        self.avg_gen_sec = None      # 최근 생성 소요 시간(EMA) — 시작 예상 시각 계산용
+        self.counts = {"submitted": 0, "rate_limited": 0, "errors": 0, "shared": 0}
+
+    def submit(self, body: dict, user: str = "anonymous", priority: int = 0, key: str = None,
+               refresh_ref: bool = False, **tags):
+        """대기열에 넣고 (video id Future, 예상 제출 시각 epoch, 공유 여부) 를 반환.
+
+        refresh_ref 면 제출 직전에 remix 원본의 참조 URL 을 새로 받는다(캐시·저널에서 온 URL 은 만료됐을 수 있다).
+        """
+        with self.cond:   # 조회와 등록을 한 임계 구역에서 해야 같은 key 가 두 번 제출되지 않는다
+            shared = self.flights.get(key) if key else None
+            if shared is not None:
+                shared["jobs"].add(tags.get("job"))
+                shared["refresh_ref"] |= refresh_ref
+                self.counts["shared"] += 1
+                queued = not shared["future"].done()
+                return shared["future"], self._eta(shared) if queued else time.time(), True
+            ticket = {"body": body, "user": user, "priority": priority, "tags": tags, "key": key,
+                      "refresh_ref": refresh_ref, "jobs": {tags.get("job")}, "future": Future(), "queued_at": time.time()}
+            if key:
+                self.flights[key] = ticket
+            self.queues.setdefault(priority, {}).setdefault(user, deque()).append(ticket)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name="sora-submit", daemon=True)
+                self.thread.start()
+            eta = self._eta(ticket)
+            self.cond.notify_all()
+        return ticket["future"], eta, False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def _eta(self, ticket: dict):
+        """라운드로빈 순서상 앞선 제출 수로 대략의 제출 시각을 추정."""
+        p, user = ticket["priority"], ticket["user"]
+        users = self.queues.get(p, {})
+        mine = users.get(user) or deque()
+        k = mine.index(ticket) if ticket in mine else 0
+        ahead = sum(len(q) for pp, uu in self.queues.items() if pp > p for q in uu.values())
+        ahead += k + sum(min(len(q), k) for u, q in users.items() if u != user)
+        n, now = ahead + 1, time.time()
+        self._refill()
+        t_token = max(0.0, n - self.tokens) / self.rate if self.rate > 0 else 0.0
+        free = self.max_inflight - self.inflight
+        gen = self.avg_gen_sec or ticket["body"].get("duration_sec", 10) * POLL_EXPECT_PER_SEC
+        t_slot = 0.0 if n <= free else math.ceil((n - free) / self.max_inflight) * gen
+        return now + max(self.paused_until - now, t_token, t_slot, 0.0)
+
+    def _pop(self):
+        for p in sorted(self.queues, reverse=True):
+            users = self.queues[p]
+            if not users:
+                continue
+            user = next(iter(users))
+            q = users.pop(user)
+            ticket = q.popleft()
+            if q:
+                users[user] = q      # 같은 사용자는 맨 뒤로
+            return ticket
+        return None
+
+    def _requeue_front(self, ticket: dict):
+        users = self.queues.setdefault(ticket["priority"], {})
+        q = users.pop(ticket["user"], deque())
+        q.appendleft(ticket)
+        self.queues[ticket["priority"]] = {ticket["user"]: q, **users}
+
+    def _ready_wait(self):
+        """바로 제출 가능하면 0, 아니면 기다릴 초(None 이면 알림까지)."""
+        if not any(self.queues.values()) or self.inflight >= self.max_inflight:
+            return None
+        pause = self.paused_until - time.time()
+        if pause > 0:
+            return pause
+        self._refill()
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate if self.rate > 0 else None
+        return 0
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while (wait := self._ready_wait()) != 0:
+                    self.cond.wait(timeout=wait)
+                ticket = self._pop()
+                self.tokens -= 1
+                self.inflight += 1
+            try:
+                body = fresh_ref_body(ticket["body"]) if ticket["refresh_ref"] else ticket["body"]
+                vid = SORA.create(body, retry_429=False)
+            except RateLimited as e:
+                with self.cond:
+                    self.inflight -= 1
+                    self.tokens = 0.0
+                    self.paused_until = time.time() + e.retry_after
+                    self.counts["rate_limited"] += 1
+                    self._requeue_front(ticket)
+                log_event("sora_rate_limited", retry_after=round(e.retry_after, 1), **ticket["tags"])
+                continue
+            except Exception as e:
+                with self.cond:
+                    self.inflight -= 1
+                    self.counts["errors"] += 1
+                    self._land(ticket)
+                    self.cond.notify_all()
+                ticket["future"].set_exception(e)
+                continue
+            with self.cond:
+                self.counts["submitted"] += 1
+            t0 = time.time()
+            fut = self.poller.track(vid, ticket["body"].get("duration_sec", 0), **ticket["tags"])
+            fut.add_done_callback(lambda f, t0=t0, t=ticket: self._finished(time.time() - t0, t, f.exception() is None))
+            ticket["future"].set_result(vid)
+
+    def _land(self, ticket: dict):
+        """ticket 의 single-flight 등록 해제(생성이 끝났거나 실패·취소)."""
+        if ticket["key"] and self.flights.get(ticket["key"]) is ticket:
+            del self.flights[ticket["key"]]
+
+    def cancel(self, job_id: str):
+        """job_id 의 대기 중인 제출을 모두 취소. 다른 작업과 공유 중인 제출은 남긴다. 취소한 수를 반환."""
+        n = 0
+        with self.cond:
+            for p, users in self.queues.items():
+                for u in list(users):
+                    keep = deque()
+                    for t in users[u]:
+                        t["jobs"].discard(job_id)
+                        if not t["jobs"]:
+                            t["future"].cancel()
+                            self._land(t)
+                            n += 1
+                        else:
+                            keep.append(t)
+                    if keep:
+                        users[u] = keep
+                    else:
+                        del users[u]
+        return n
+
+    def _finished(self, gen_sec: float, ticket: dict, ok: bool = True):
+        with self.cond:
+            self.inflight -= 1
+            self._land(ticket)
+            if ok:   # 실패·시간 초과는 생성 시간 추정에 넣지 않는다
+                self.avg_gen_sec = gen_sec if self.avg_gen_sec is None else 0.8 * self.avg_gen_sec + 0.2 * gen_sec
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            self._refill()
+            queued = [t for uu in self.queues.values() for q in uu.values() for t in q]
+            return {
+                "rate_per_min": self.rate * 60, "burst": self.burst, "tokens": round(self.tokens, 2),
+                "max_inflight": self.max_inflight, "inflight": self.inflight,
+                "paused_for_sec": round(max(0.0, self.paused_until - time.time()), 1),
+                "avg_gen_sec": round(self.avg_gen_sec, 1) if self.avg_gen_sec else None,
+                "queued": len(queued), **self.counts,
+                "queue": [{"user": t["user"], "priority": t["priority"], **t["tags"], "eta": round(self._eta(t), 1)}
+                          for t in queued[:100]],
+            }
+
+SORA = SoraClient(BASE_URL, HEADERS)
+POLLER = StatusPoller(SORA)
+SUBMITTER = SubmitScheduler(POLLER)
+
+def build_clip_body(prompt_text: str, ratio: str, cut_sec: int,
+                    characters: list, global_voice: str, global_lang: str,
+                    global_prompt: str = "", remix_id=None, ref_url=None, inherit="strong"):
+    """Sora 생성 요청 본문. 클립 캐시 키도 이 본문으로 만든다."""
     refs = []
     for c in characters:
         if c.get("image_url"):
@@ -322,163 +1221,1556 @@ def create_clip(prompt_text: str, ratio: str, cut_sec: int,
         "reference_inputs": refs or None,
         "audio_config": {"voice": global_voice, "language": global_lang}
     }
-    r = requests.post(BASE_URL, headers=HEADERS, json=body, timeout=60)
-    if r.status_code >= 400:
-        abort(r.status_code, description=r.text)
-    return r.json()["id"]
+    return body
 
-def wait_done(video_id: str):
-    status_url = f"{BASE_URL}/{video_id}"
-    while True:
-        r = requests.get(status_url, headers=HEADERS, timeout=60)
-        if r.status_code >= 400:
-            abort(r.status_code, description=r.text)
-        j = r.json()
-        st = j.get("status")
-        if st == "completed":
-            return j.get("download_url") or j.get("output_url")
-        if st == "failed":
-            abort(500, description=f"Generation failed: {j}")
-        time.sleep(4)
+def submit_clip(body: dict, user: str = "anonymous", priority: int = 0, refresh_ref: bool = False, **tags):
+    """제출 스케줄러에 넣는다. (video id Future, 예상 제출 시각, 공유 여부) 반환.
+
+    같은 본문이 이미 대기·생성 중이면(다른 작업이나 같은 작업의 중복 장면) 그 결과를 공유한다.
+    키는 받은 본문으로 만든다. refresh_ref 는 remix 원본 URL 이 캐시·저널에서 온 경우에만 준다.
+    """
+    if not TOKEN:
+        abort(500, description="SORA_TOKEN is not set")
+    return SUBMITTER.submit(body, user=user, priority=priority, key=ClipCache.key(body), refresh_ref=refresh_ref, **tags)
+
+def fresh_ref_body(body: dict):
+    """remix 원본 영상의 참조 URL 을 상태 조회(한 번, 재시도 없음)로 새로 받아 바꾼 본문.
+
+    제출 스케줄러가 생성 요청 직전에 부른다. 조회에 실패하면 원래 본문을 그대로 쓴다.
+    """
+    vid, refs = body.get("remix_id"), body.get("reference_inputs") or []
+    if not vid or not any(r["type"] == "video" for r in refs):
+        return body
+    try:
+        j = SORA.status(vid, retries=0, retry_429=False)
+    except Exception as e:
+        log_event("ref_refresh_failed", video_id=vid, error=str(e))
+        return body
+    url = j.get("download_url") or j.get("output_url")
+    if not url:
+        return body
+    return {**body, "reference_inputs": [dict(r, url=url) if r["type"] == "video" else r for r in refs]}
+
+def wait_done(video_id: str, duration_sec: int = 0, **tags):
+    """공유 폴러에 등록하고 완료될 때까지 대기. 다운로드 URL 을 반환."""
+    return POLLER.track(video_id, duration_sec, **tags).result()
 
 # ===== Routes =====
 @app.route("/")
 def index():
-    return render_template_string(HTML, plan=PLAN, cut=resolve_cut_sec())
+    return render_template_string(HTML, plan=PLAN, cut=resolve_cut_sec(), hls_js_url=HLS_JS_URL, hls_js_sri=HLS_JS_SRI)
+
+def guess_characters(topic: str):
+    """토픽으로부터 러프 캐릭터 이름 추정."""
+    names = []
+    if re.search(r"할머니|노부인", topic): names.append("할머니")
+    if re.search(r"회장|사장|대표", topic): names.append("회장")
+    if re.search(r"직원|점원|알바", topic): names += ["직원A", "직원B"]
+    if not names: names = ["주인공", "상대역"]
+    # 중복 제거
+    s, res = set(), []
+    for n in names:
+        if n not in s: res.append(n); s.add(n)
+    return res
+
+def make_script(topic: str, total_length: int, cuts=None):
+    """주제 → 자동 시나리오·캐릭터. /autoscript 와 /batch 가 함께 쓴다."""
+    cut_sec = resolve_cut_sec()
+    cuts = int(cuts) if str(cuts or "").strip().isdigit() else 0
+    cut_count = cuts if cuts > 0 else max(1, math.ceil(total_length / cut_sec))
+
+    topic = (topic or "").strip() or "일상적인 상황에서의 작은 반전"
+
+    # 아주 단순한 자동 시나리오 템플릿
+    scenes = [f"Scene {i}: {topic} — maintain same cast and visuals; advance the story logically. Camera subtle motion."
+              for i in range(1, cut_count+1)]
+    return {
+        "scenario": scenes,
+        "characters": [{"name": n} for n in guess_characters(topic)],
+        "cut_sec": cut_sec,
+        "cut_count": cut_count
+    }
 
 @app.route("/autoscript", methods=["POST"])
 def autoscript():
     try:
-        topic = (request.form.get("topic") or "").strip()
-        total_length = int(request.form.get("total_length", "60"))
-        ratio = request.form.get("ratio", "9:16")
-        lang  = request.form.get("lang", "ko-KR")
-        cuts_in = request.form.get("cuts", "").strip()
-
-        cut_sec = resolve_cut_sec()
-        cut_count = int(cuts_in) if cuts_in.isdigit() and int(cuts_in)>0 else max(1, math.ceil(total_length / cut_sec))
-
-        if not topic:
-            topic = "일상적인 상황에서의 작은 반전"
-
-        # 아주 단순한 자동 시나리오 템플릿
-        scenes = [f"Scene {i}: {topic} — maintain same cast and visuals; advance the story logically. Camera subtle motion."
-                  for i in range(1, cut_count+1)]
-
-        # 토픽으로부터 러프 캐릭터 추정
-        def guess_chars_kor(t):
-            names = []
-            if re.search(r"할머니|노부인", t): names.append("할머니")
-            if re.search(r"회장|사장|대표", t): names.append("회장")
-            if re.search(r"직원|점원|알바", t): names += ["직원A", "직원B"]
-            if not names: names = ["주인공", "상대역"]
-            # 중복 제거
-            s, res = set(), []
-            for n in names:
-                if n not in s: res.append(n); s.add(n)
-            return res
-
-        char_names = guess_chars_kor(topic)
-
-        return jsonify({
-            "status":"success",
-            "scenario": scenes,
-            "characters": [{"name": n} for n in char_names],
-            "cut_sec": cut_sec,
-            "cut_count": cut_count
-        })
+        script = make_script(request.form.get("topic"), int(request.form.get("total_length", "60")),
+                             request.form.get("cuts", ""))
+        return jsonify({"status":"success", **script})
     except Exception as e:
         return jsonify({"status":"error","message":str(e)}), 500
 
-@app.route("/generate", methods=["POST"])
-def generate():
+# ===== 클립 캐시 =====
+def _link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
     try:
-        data = request.get_json(force=True)
-        total_length = int(data.get("total_length", 60))
-        ratio   = data.get("ratio", "9:16")
-        lang    = data.get("lang", "ko-KR")
-        inherit = data.get("inherit", "strong")
-        voice   = data.get("voice", "female_calm")
-        global_prompt = data.get("global_prompt", "")
-        scenario = data.get("scenario") or []
-        characters = data.get("characters") or []
-        use_bgm = data.get("use_bgm", "no")
-        bgm_url = data.get("bgm_url", "")
-        bgm_vol = float(data.get("bgm_vol", 0.25))
-
-        cut_sec   = resolve_cut_sec()
-        cut_count = max(1, math.ceil(total_length / cut_sec))
-        if len(scenario) < cut_count:
-            scenario += [scenario[-1] if scenario else "Continue the story."] * (cut_count - len(scenario))
-        elif len(scenario) > cut_count:
-            scenario = scenario[:cut_count]
-
-        prev_id, prev_url = None, None
-        outputs = []
-
-        for i, text in enumerate(scenario, 1):
-            vid = create_clip(text, ratio, cut_sec, characters, voice, lang,
-                              global_prompt=global_prompt, remix_id=prev_id, ref_url=prev_url, inherit=inherit)
-            url = wait_done(vid)
-
-            raw  = f"clip_{i}_raw.mp4"
-            done = f"clip_{i}.mp4"
-            with requests.get(url, stream=True) as rr:
-                rr.raise_for_status()
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class ClipCache:
+    """생성 요청 본문을 키로 하는 내용 주소 캐시.
+
+    항목은 원격 video id·URL 과 후처리된 clip 파일을 가진다. 디스크 용량을 넘기면
+    오래 쓰지 않은 파일부터 지우되, video id 는 남겨 재생성 없이 다시 받을 수 있게 한다.
+    """
+    SAVE_EVERY = 60   # 조회만 있을 때 index.json 에 atime 을 반영하는 최소 간격(초)
+
+    def __init__(self, root: str, max_bytes: int = CLIP_CACHE_MAX_BYTES, max_entries: int = CLIP_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.index = {}
+        self.saved = time.time()
+        if root:
+            os.makedirs(root, exist_ok=True)
+            try:
+                with open(self._index_path(), encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def _index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _save(self):
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path())
+        self.saved = time.time()
+
+    @staticmethod
+    def key(body: dict):
+        # 후처리 결과물이 FINISH_MODE 에 따라 달라지므로 키에 포함
+        raw = json.dumps({"body": body, "finish": FINISH_MODE}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """캐시 항목(video_id, url, file, blur) 또는 None. 파일이 사라졌으면 file 은 None."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            ent = self.index.get(key)
+            if ent is None:
+                return None
+            if ent.get("file") and not os.path.exists(ent["file"]):
+                ent["file"], ent["size"] = None, 0
+            ent["atime"] = time.time()   # 메모리에만 갱신하고 put 때나 SAVE_EVERY 마다 한꺼번에 저장
+            if ent["atime"] - self.saved >= self.SAVE_EVERY:
+                self._save()
+            return dict(ent)
+
+    def fetch(self, key: str, dst: str):
+        """캐시 파일을 dst 로 가져와 clip dict 를 반환. 파일이 없으면 None."""
+        ent = self.get(key)
+        if not ent or not ent.get("file"):
+            return None
+        try:
+            _link_or_copy(ent["file"], dst)
+        except OSError:
+            return None
+        return {"path": dst, "blur": tuple(ent["blur"]) if ent.get("blur") else None}
+
+    def put(self, key: str, video_id: str, url: str, clip: dict):
+        if not self.enabled:
+            return
+        dst = os.path.join(self.root, f"{key}.mp4")
+        _link_or_copy(clip["path"], dst)
+        with self.lock:
+            self.index[key] = {"video_id": video_id, "url": url, "file": dst, "size": os.path.getsize(dst),
+                               "blur": clip.get("blur"), "atime": time.time()}
+            self._evict()
+            self._save()
+
+    def _evict(self):
+        by_age = sorted(self.index.items(), key=lambda kv: kv[1]["atime"])
+        total = sum(e.get("size", 0) for _, e in by_age)
+        for k, e in by_age:
+            if total <= self.max_bytes:
+                break
+            if e.get("file"):
+                try:
+                    os.remove(e["file"])
+                except OSError:
+                    pass
+                total -= e.get("size", 0)
+                e["file"], e["size"] = None, 0
+        for k, _ in by_age[:max(0, len(self.index) - self.max_entries)]:
+            if self.index[k].get("file"):
+                continue
+            del self.index[k]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index),
+                    "files": sum(1 for e in self.index.values() if e.get("file")),
+                    "bytes": sum(e.get("size", 0) for e in self.index.values())}
+
+CLIP_CACHE = ClipCache(CLIP_CACHE_DIR)
+
+# ===== BGM 캐시 =====
+def normalize_bgm(src: str, dst: str):
+    """BGM 을 최종 출력과 같은 샘플레이트의 스테레오 AAC 로 미리 변환(최종 패스에서 리샘플·디코딩 부담 제거)."""
+    run_ffmpeg(["ffmpeg","-y","-i", src, "-vn", "-ac","2", "-ar", str(AUDIO_RATE),
+                "-c:a","aac","-b:a","192k", "-f","mp4", dst])
+
+class BgmCache:
+    """URL 을 키로 하는 BGM 캐시. 정규화된 m4a 를 보관하고 ETag/Last-Modified 로 재검증, 용량 초과 시 LRU 삭제."""
+    def __init__(self, root: str, max_bytes: int = BGM_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.key_locks = {}   # 같은 URL 을 동시에 받지 않도록 키별 잠금
+        self.index = {}
+        if root:
+            os.makedirs(root, exist_ok=True)
+            try:
+                with open(self._index_path(), encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def _index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _save(self):
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path())
+
+    def get(self, url: str, job, span: dict = None):
+        """정규화된 BGM 파일 경로. 캐시를 끄면 작업 폴더에 받아 변환한다."""
+        if not self.enabled:
+            raw = job.path("bgm_src")
+            download_to(url, raw, span, kind="bgm")
+            normalize_bgm(raw, job.path("bgm.m4a"))
+            os.remove(raw)
+            BGM_TOTAL.labels("miss").inc()
+            return job.path("bgm.m4a")
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self.lock:
+            klock = self.key_locks.setdefault(key, threading.Lock())
+        with klock:
+            result, path = self._get(key, url, span)
+            # 작업 폴더로 링크해 두면 작업 도중 캐시에서 밀려나도 안전
+            _link_or_copy(path, job.path("bgm.m4a"))
+        BGM_TOTAL.labels(result).inc()
+        if span is not None:
+            span["cache"] = result
+        return job.path("bgm.m4a")
+
+    def _get(self, key: str, url: str, span: dict):
+        with self.lock:
+            ent = dict(self.index.get(key) or {})
+        have = bool(ent.get("file")) and os.path.exists(ent["file"])
+        if have and time.time() - ent.get("checked", 0) < BGM_REVALIDATE_SEC:
+            self._touch(key)
+            return "hit", ent["file"]
+
+        headers = {}
+        if have and ent.get("etag"):
+            headers["If-None-Match"] = ent["etag"]
+        if have and ent.get("last_modified"):
+            headers["If-Modified-Since"] = ent["last_modified"]
+        raw = os.path.join(self.root, f"{key}.src.{uuid.uuid4().hex[:6]}")
+        try:
+            t0 = time.perf_counter()
+            with SORA.request("GET", url, session=SORA.dl, stream=True, headers=headers) as r:
+                if r.status_code == 304 and have:
+                    self._touch(key, checked=True)
+                    return "revalidated", ent["file"]
+                r.raise_for_status()
                 with open(raw, "wb") as f:
-                    for chunk in rr.iter_content(1<<20):
+                    for chunk in r.iter_content(1<<20):
                         f.write(chunk)
-            blur_watermark(raw, done)
-            outputs.append(done)
-            prev_id, prev_url = vid, url
-
-        # 스티칭
-        with open("list.txt", "w", encoding="utf-8") as f:
-            for p in outputs:
-                f.write(f"file '{p}'\n")
-
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        merged = f"merged_{ts}.mp4"
-        vf = "format=yuv420p"
-        if FINAL_SCALE:
-            vf = f"scale={FINAL_SCALE}:flags=lanczos,{vf}"
-
-        subprocess.run([
-            "ffmpeg","-y","-f","concat","-safe","0","-i","list.txt",
-            "-vf", vf,
+                etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+            n, dt = os.path.getsize(raw), max(1e-6, time.perf_counter() - t0)
+            DOWNLOAD_BYTES.labels("bgm").inc(n)
+            DOWNLOAD_BPS.observe(n / dt)
+            if span is not None:
+                span.update(bytes=n, bytes_per_sec=round(n / dt))
+            dst = os.path.join(self.root, f"{key}.m4a")
+            normalize_bgm(raw, dst + ".tmp")
+            os.replace(dst + ".tmp", dst)
+        except Exception as e:
+            # 원본 서버가 잠시 안 될 때는 이전에 받아 둔 파일로 진행
+            if have:
+                log_event("bgm_stale", url=url, error=str(e))
+                return "stale", ent["file"]
+            raise
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+        with self.lock:
+            self.index[key] = {"url": url, "etag": etag, "last_modified": last_modified, "file": dst,
+                               "size": os.path.getsize(dst), "atime": time.time(), "checked": time.time()}
+            self._evict(keep=key)
+            self._save()
+        return "miss", dst
+
+    def _touch(self, key: str, checked: bool = False):
+        with self.lock:
+            ent = self.index.get(key)
+            if ent is None:
+                return
+            ent["atime"] = time.time()
+            if checked:
+                ent["checked"] = ent["atime"]
+            self._save()
+
+    def _evict(self, keep: str):
+        by_age = sorted(self.index.items(), key=lambda kv: kv[1]["atime"])
+        total = sum(e.get("size", 0) for _, e in by_age)
+        for k, e in by_age:
+            if total <= self.max_bytes:
+                break
+            if k == keep:
+                continue
+            try:
+                os.remove(e["file"])
+            except OSError:
+                pass
+            total -= e.get("size", 0)
+            del self.index[k]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index), "bytes": sum(e.get("size", 0) for e in self.index.values())}
+
+BGM_CACHE = BgmCache(BGM_CACHE_DIR)
+
+# ===== 다운로드 / 클립 파이프라인 =====
+def download_to(url: str, path: str, span: dict = None, kind: str = "clip"):
+    """다운로드 후 바이트 수·처리량을 메트릭과 span 에 기록."""
+    t0 = time.perf_counter()
+    n = SORA.download(url, path)
+    dt = max(1e-6, time.perf_counter() - t0)
+    DOWNLOAD_BYTES.labels(kind).inc(n)
+    DOWNLOAD_BPS.observe(n / dt)
+    if span is not None:
+        span.update(bytes=n, bytes_per_sec=round(n / dt))
+    return n
+
+class ClipPipeline:
+    """다운로드 → 후처리 단계를 생성 루프와 겹쳐 실행한다.
+
+    생성 루프는 put() 으로 완료된 컷을 넘기고 곧바로 다음 컷을 제출한다.
+    단계 사이 대기열은 PIPELINE_DEPTH 로 제한되어 꽉 차면 put() 이 기다린다.
+    """
+    def __init__(self, job, depth: int = PIPELINE_DEPTH):
+        self.job = job
+        self.dl_q = queue.Queue(maxsize=depth)
+        self.post_q = queue.Queue(maxsize=depth)
+        self.results = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        self.preview = HlsPreview(job, resolve_cut_sec()) if HLS_PREVIEW else None
+        self.dl_threads = [threading.Thread(target=self._download_loop, daemon=True) for _ in range(DOWNLOAD_WORKERS)]
+        self.post_threads = [threading.Thread(target=self._post_loop, daemon=True) for _ in range(POST_WORKERS)]
+        for t in self.dl_threads + self.post_threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self._fail(exc)   # 생성 루프가 실패하면 남은 컷 처리도 건너뛴다
+        self.close()
+        return False
+
+    def _fail(self, e):
+        with self.lock:
+            self.errors.append(e)
+
+    def put(self, i: int, url: str, video_id=None, cache_key=None, download_url=None):
+        """url 은 캐시에 기록될 URL, download_url 은 실제로 받을 URL(없으면 url)."""
+        if self.errors:
+            raise self.errors[0]
+        self.dl_q.put((i, url, video_id, cache_key, download_url or url))
+
+    def add_ready(self, i: int, clip: dict):
+        """캐시에서 바로 꺼낸 컷. 다운로드·후처리 단계를 건너뛴다."""
+        self._done(i, clip, cached=True)
+
+    def _done(self, i: int, clip: dict, cached: bool = False):
+        CLIPS_TOTAL.labels("cache" if cached else "generated").inc()
+        JOURNAL.clip(self.job.id, i, status="ready", path=clip["path"], blur=clip.get("blur"))
+        self.job.track_disk()
+        with self.lock:
+            self.results[i] = clip
+            self.job.clips_done += 1
+            n = self.job.clips_done
+        self.job.emit("clip_done", clip=i, done=n, total=self.job.clips_total, cached=cached)
+        if self.preview:
+            self.preview.add(i, clip)
+
+    def _download_loop(self):
+        while (item := self.dl_q.get()) is not None:
+            if self.errors:
+                continue   # 실패 이후 남은 컷은 버린다
+            i, url, video_id, cache_key, download_url = item
+            try:
+                if STREAM_INPUT != "off" and FINISH_MODE == "legacy":
+                    # 흐림 인코딩이 URL 에서 직접 읽으므로 원본을 디스크에 쓰지 않는다
+                    self.post_q.put((i, download_url, url, video_id, cache_key))
+                    continue
+                raw = self.job.path(f"clip_{i}_raw.mp4")
+                with self.job.stage("download", clip=i) as span:
+                    download_to(download_url, raw, span)
+                self.job.track_disk()
+                self.post_q.put((i, raw, url, video_id, cache_key))
+            except Exception as e:
+                self._fail(e)
+
+    def _post_loop(self):
+        while (item := self.post_q.get()) is not None:
+            if self.errors:
+                continue
+            i, raw, url, video_id, cache_key = item
+            try:
+                with self.job.stage("postprocess", clip=i):
+                    clip = prepare_clip(raw, self.job.path(f"clip_{i}.mp4"), self.job.params.get("ratio"))
+                if cache_key:
+                    CLIP_CACHE.put(cache_key, video_id, url, clip)
+                self._done(i, clip)
+            except Exception as e:
+                self._fail(e)
+
+    def close(self):
+        """대기 중인 컷을 모두 처리하고 단계 스레드를 정리."""
+        for _ in self.dl_threads:
+            self.dl_q.put(None)
+        for t in self.dl_threads:
+            t.join()
+        for _ in self.post_threads:
+            self.post_q.put(None)
+        for t in self.post_threads:
+            t.join()
+        if self.preview:
+            self.preview.close()
+
+    def outputs(self):
+        if self.errors:
+            raise self.errors[0]
+        return [self.results[i] for i in sorted(self.results)]
+
+# ===== 미리보기(HLS) =====
+class HlsPreview:
+    """후처리가 끝난 컷을 HLS 세그먼트로 만들어 라이브 재생목록에 순서대로 덧붙인다.
+
+    컷마다 타임스탬프가 0 부터 시작하므로 세그먼트 사이에 EXT-X-DISCONTINUITY 를 넣는다.
+    흐림이 최종 인코딩으로 미뤄진 컷(single)은 가볍게 재인코딩하고, 이미 흐림된 컷은 스트림 복사한다.
+    미리보기 실패는 작업을 실패시키지 않는다. 생성이 끝나면 아직 만들지 않은 세그먼트는 버린다
+    (최종 인코딩이 볼 사람 없는 미리보기 인코딩을 기다리지 않도록).
+    """
+    PLAYLIST = "index.m3u8"
+
+    def __init__(self, job, seg_sec: int):
+        self.job = job
+        self.seg_sec = seg_sec
+        self.dir = job.path("hls")
+        self.ready = {}       # 컷 번호 → (세그먼트 파일명, 길이 초). 실패 시 (None, 0)
+        self.published = []
+        self.q = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"/jobs/{self.job.id}/hls/{self.PLAYLIST}"
+
+    def add(self, i: int, clip: dict):
+        self.q.put((i, clip))
+
+    def close(self):
+        """대기 중인 세그먼트는 버리고, 만들던 것 하나만 기다린 뒤 재생목록을 닫는다(EXT-X-ENDLIST)."""
+        dropped = 0
+        while True:
+            try:
+                dropped += self.q.get_nowait() is not None
+            except queue.Empty:
+                break
+        if dropped:
+            log_event("preview_dropped", job=self.job.id, clips=dropped)
+        self.q.put(None)
+        self.thread.join()
+        self._write(end=True)
+
+    def _loop(self):
+        while (item := self.q.get()) is not None:
+            i, clip = item
+            name, dur = f"seg_{i}.ts", 0.0
+            try:
+                os.makedirs(self.dir, exist_ok=True)
+                with self.job.stage("preview", clip=i):
+                    self._segment(clip, os.path.join(self.dir, name))
+                    _, dur = probe_audio(clip["path"])   # 세그먼트 길이 = 원본 컷 길이
+            except Exception as e:
+                log_event("preview_failed", job=self.job.id, clip=i, error=str(e))
+                name = None
+            self.ready[i] = (name, dur or float(self.seg_sec))
+            self._publish()
+
+    def _segment(self, clip: dict, out: str):
+        cmd = ["ffmpeg","-y","-i", clip["path"]]
+        if not clip.get("blur"):
+            run_ffmpeg(cmd + ["-map","0:v","-map","0:a?","-c","copy","-f","mpegts", out])
+            return
+        vf = blur_filter("[0:v]", clip["blur"])
+        if HLS_PREVIEW_HEIGHT:
+            vf += f",scale=-2:'min(ih,{HLS_PREVIEW_HEIGHT})'"
+        run_ffmpeg(cmd + ["-filter_complex", vf + ",format=yuv420p[v]", "-map","[v]","-map","0:a?",
+                          "-c:v","libx264","-preset","veryfast","-crf", HLS_PREVIEW_CRF,
+                          "-c:a","aac","-b:a","128k","-f","mpegts", out], encode="preview")
+
+    def _publish(self):
+        """앞 번호부터 연속으로 준비된 세그먼트만 재생목록에 올린다."""
+        added = 0
+        nxt = len(self.published) + 1
+        while nxt in self.ready:
+            self.published.append(self.ready.pop(nxt))
+            added += 1
+            nxt += 1
+        if added:
+            self._write(end=False)
+            self.job.emit("preview", url=self.url, clips=len(self.published))
+
+    def _write(self, end: bool):
+        if not os.path.isdir(self.dir):
+            return
+        segs = [(name, dur) for name, dur in self.published if name]
+        # TARGETDURATION 은 모든 EXTINF 를 반올림한 값 이상이어야 하고 도중에 바뀌면 안 되므로
+        # 컷 길이보다 1초 여유를 둔다(그래도 넘는 세그먼트가 있으면 그 값으로)
+        target = max([self.seg_sec + 1] + [round(dur) for _, dur in segs])
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target}",
+                 "#EXT-X-PLAYLIST-TYPE:EVENT", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for k, (name, dur) in enumerate(segs):
+            if k:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines += [f"#EXTINF:{dur:.3f},", name]
+        if end:
+            lines.append("#EXT-X-ENDLIST")
+        path = os.path.join(self.dir, self.PLAYLIST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+# ===== 스티칭 / 최종 인코딩 =====
+def write_concat_list(paths, list_path: str):
+    # concat demuxer 는 상대 경로를 목록 파일 기준으로 해석하므로 절대 경로로 기록
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in paths:
+            p = os.path.abspath(p).replace("'", "'\\''")
+            f.write(f"file '{p}'\n")
+    return list_path
+
+def bgm_mix(a_in: str, bgm_idx: int, vol: float):
+    """본 오디오 a_in 에 입력 bgm_idx 의 BGM 을 섞는 필터. 출력 패드는 [aout]."""
+    return f"[{bgm_idx}:a]volume={vol}[bgm];{a_in}[bgm]amix=inputs=2:duration=longest:dropout_transition=2[aout]"
+
+def finish_single(job, clips, output: str, bgm_file=None, bgm_vol: float = 0.25):
+    """컷별 흐림, concat, FINAL_SCALE, BGM amix 를 하나의 filtergraph 로 묶어 한 번만 인코딩.
+
+    오디오가 없는 컷은 그 길이만큼의 무음(anullsrc)으로 채워 concat 에 넣는다.
+    """
+    audio = [probe_audio(c["path"]) for c in clips]
+    if not FINAL_SCALE and not any(c["blur"] for c in clips) and all(a for a, _ in audio):
+        # 흐림·스케일이 필요 없으면 영상은 스트림 복사, 오디오만 필요 시 믹스
+        list_path = write_concat_list([c["path"] for c in clips], job.path("list.txt"))
+        cmd = ["ffmpeg","-y","-f","concat","-safe","0","-i",list_path]
+        if bgm_file:
+            cmd += ["-i", bgm_file, "-filter_complex", bgm_mix("[0:a]", 1, bgm_vol),
+                    "-map","0:v","-map","[aout]","-c:v","copy","-c:a","aac","-b:a","192k","-ar",str(AUDIO_RATE)]
+        else:
+            cmd += ["-c","copy"]
+        run_ffmpeg(cmd + ["-movflags","+faststart", output])
+        return
+
+    cmd, graph, pads = ["ffmpeg","-y"], [], []
+    for k, (c, (has_a, dur)) in enumerate(zip(clips, audio)):
+        cmd += ["-i", c["path"]]
+        v = f"[{k}:v]"
+        if c["blur"]:
+            graph.append(blur_filter(v, c["blur"], f"[v{k}]"))
+            v = f"[v{k}]"
+        a = f"[{k}:a]"
+        if not has_a:
+            graph.append(f"anullsrc=r={AUDIO_RATE}:cl=stereo,atrim=duration={dur:.3f}[s{k}]")
+            a = f"[s{k}]"
+        pads.append(v + a)
+    graph.append(f"{''.join(pads)}concat=n={len(clips)}:v=1:a=1[vc][ac]")
+    vf = "format=yuv420p"
+    if FINAL_SCALE:
+        vf = f"scale={FINAL_SCALE}:flags=lanczos,{vf}"
+    graph.append(f"[vc]{vf}[vout]")
+    aout, abr = "[ac]", "128k"
+    if bgm_file:
+        cmd += ["-i", bgm_file]
+        graph.append(bgm_mix("[ac]", len(clips), bgm_vol))
+        aout, abr = "[aout]", "192k"
+    run_ffmpeg(cmd + [
+        "-filter_complex", ";".join(graph),
+        "-map","[vout]","-map", aout,
+        "-c:v","libx264","-preset","fast","-crf","18",
+        "-c:a","aac","-b:a", abr, "-ar", str(AUDIO_RATE), "-movflags","+faststart",
+        output
+    ], encode="final")
+
+def finish_legacy(job, clips, output: str, bgm_file=None, bgm_vol: float = 0.25):
+    """기존 경로: 흐림된 컷을 재인코딩으로 이어 붙이며 BGM 도 같은 패스에서 믹스."""
+    job.emit("stage", stage="concat")
+    list_path = write_concat_list([c["path"] for c in clips], job.path("list.txt"))
+    vf = "format=yuv420p"
+    if FINAL_SCALE:
+        vf = f"scale={FINAL_SCALE}:flags=lanczos,{vf}"
+
+    cmd = ["ffmpeg","-y","-f","concat","-safe","0","-i",list_path]
+    if bgm_file:
+        cmd += ["-i", bgm_file, "-filter_complex", f"[0:v]{vf}[vout];" + bgm_mix("[0:a]", 1, bgm_vol),
+                "-map","[vout]","-map","[aout]","-c:a","aac","-b:a","192k"]
+    else:
+        cmd += ["-vf", vf, "-c:a","aac","-b:a","128k"]
+    with job.stage("concat"):
+        run_ffmpeg(cmd + [
             "-c:v","libx264","-preset","fast","-crf","18",
-            "-c:a","aac","-b:a","128k",
-            merged
-        ], check=True)
-
-        # BGM 믹스(선택)
-        final_name = merged
-        if use_bgm == "yes" and bgm_url:
-            bgm_file = f"bgm_{ts}.mp3"
-            with requests.get(bgm_url, stream=True) as rbgm:
-                rbgm.raise_for_status()
-                with open(bgm_file, "wb") as f:
-                    for ck in rbgm.iter_content(1<<20):
-                        f.write(ck)
-            final_name = f"output_final_{ts}.mp4"
-            subprocess.run([
-                "ffmpeg","-y","-i", merged, "-i", bgm_file,
-                "-filter_complex", f"[1:a]volume={bgm_vol}[bgm];[0:a][bgm]amix=inputs=2:duration=longest:dropout_transition=2[aout]",
-                "-map","0:v","-map","[aout]",
-                "-c:v","copy","-c:a","aac","-b:a","192k", final_name
-            ], check=True)
-
-        return jsonify({"status":"success","filename": final_name})
+            "-ar", str(AUDIO_RATE), output
+        ], encode="final")
+
+# ===== 저장소 / 보존 정책 =====
+def dir_bytes(root: str):
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def collect_outputs(max_age: int = OUTPUT_MAX_AGE_SEC, max_bytes: int = OUTPUT_MAX_BYTES):
+    """오래된 결과물을 지우고, 남은 총량이 max_bytes 를 넘으면 오래된 순으로 더 지운다."""
+    now, removed = time.time(), []
+    files = []
+    for e in os.scandir(OUTPUT_DIR):
+        if e.is_file():
+            st = e.stat()
+            files.append((st.st_mtime, st.st_size, e.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed.append(os.path.basename(path))
+            total -= size
+        except OSError:
+            pass
+    # 비정상 종료로 남은 작업 폴더 정리 (실행 중인 작업 제외)
+    with JOBS_LOCK:
+        live = {jid for jid, j in JOBS.items() if not j.terminal}
+    for e in os.scandir(SCRATCH_DIR):
+        if e.is_dir() and e.name not in live and now - e.stat().st_mtime > JOB_TTL_SEC:
+            shutil.rmtree(e.path, ignore_errors=True)
+    return removed
+
+_GC_THREAD = None
+
+def _gc_loop():
+    while True:
+        try:
+            collect_outputs()
+        except Exception as e:   # 다음 주기에 다시 시도하되 실패는 남긴다
+            log_event("gc_failed", error=f"{type(e).__name__}: {e}", output_dir=OUTPUT_DIR, scratch_dir=SCRATCH_DIR)
+        time.sleep(GC_INTERVAL_SEC)
+
+def ensure_gc():
+    """보존 정책 수집기를 (fork 이후 첫 사용 시) 띄운다."""
+    global _GC_THREAD
+    if _GC_THREAD is None or not _GC_THREAD.is_alive():
+        _GC_THREAD = threading.Thread(target=_gc_loop, name="retention-gc", daemon=True)
+        _GC_THREAD.start()
+
+# ===== 작업 저널 =====
+class JobJournal:
+    """작업과 컷 진행 상황을 SQLite(WAL)에 먼저 기록하는 저널.
+
+    제출된 video id, 상태, 다운로드 URL, 로컬 산출물 경로를 남겨 두고, 프로세스가 죽으면
+    다음 기동 때 끝나지 않은 작업을 같은 id 로 다시 붙여 이미 비용을 치른 컷을 이어 쓴다.
+    각 작업에는 소유 프로세스(pid + 기동 토큰)를 적어 살아 있는 다른 워커의 작업은 가져가지 않는다.
+    """
+    TOKEN = uuid.uuid4().hex   # 이 프로세스의 기동 토큰
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.db.row_factory = sqlite3.Row
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, params TEXT NOT NULL, state TEXT NOT NULL,
+                    created REAL, updated REAL, filename TEXT, error TEXT,
+                    owner_pid INTEGER, owner_token TEXT);
+                CREATE TABLE IF NOT EXISTS clips (
+                    job_id TEXT NOT NULL, clip INTEGER NOT NULL, key TEXT, video_id TEXT, status TEXT,
+                    url TEXT, path TEXT, blur TEXT, updated REAL, PRIMARY KEY (job_id, clip));
+            """)
+
+    @property
+    def enabled(self):
+        return self.db is not None
+
+    def _exec(self, sql: str, args=()):
+        with self.lock:
+            return self.db.execute(sql, args)
+
+    def job(self, job):
+        """작업 상태 기록(생성 시 params 포함)."""
+        if not self.enabled:
+            return
+        self._exec("""INSERT INTO jobs (id, params, state, created, updated, filename, error, owner_pid, owner_token)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT(id) DO UPDATE SET state=excluded.state, updated=excluded.updated,
+                        filename=excluded.filename, error=excluded.error,
+                        owner_pid=excluded.owner_pid, owner_token=excluded.owner_token""",
+                   (job.id, json.dumps(job.params, ensure_ascii=False), job.state, job.created, time.time(),
+                    job.filename, job.error, os.getpid(), self.TOKEN))
+
+    def clip(self, job_id: str, i: int, **fields):
+        """컷 i 의 진행 단계(status: submitted → generated → ready)와 값들을 덮어쓴다."""
+        if not self.enabled:
+            return
+        if "blur" in fields:
+            fields["blur"] = json.dumps(fields["blur"])
+        cols = ["job_id", "clip", "updated", *fields]
+        sets = ", ".join(f"{c}=excluded.{c}" for c in cols[2:])
+        self._exec(f"INSERT INTO clips ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                   f"ON CONFLICT(job_id, clip) DO UPDATE SET {sets}",
+                   (job_id, i, time.time(), *fields.values()))
+
+    def clips(self, job_id: str):
+        rows = self._exec("SELECT * FROM clips WHERE job_id=?", (job_id,)).fetchall()
+        return {r["clip"]: {**dict(r), "blur": json.loads(r["blur"]) if r["blur"] else None} for r in rows}
+
+    def snapshot(self, job_id: str):
+        """메모리에 없는(재시작 이전) 작업의 기록된 상태."""
+        if not self.enabled:
+            return None
+        r = self._exec("SELECT id, state, created, updated, filename, error FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return dict(r) if r else None
+
+    @staticmethod
+    def _alive(pid: int):
+        if not pid or pid == os.getpid():
+            return False   # 같은 pid 라도 토큰이 다르면 재시작 전 프로세스
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def claim_orphans(self):
+        """소유 프로세스가 사라진 미완료 작업을 이 프로세스 소유로 바꾸고 [(id, params)] 로 반환."""
+        if not self.enabled:
+            return []
+        rows = self._exec("SELECT id, params, owner_pid, owner_token FROM jobs WHERE state IN ('queued', 'running')"
+                          " ORDER BY created").fetchall()
+        claimed = []
+        for r in rows:
+            if r["owner_token"] == self.TOKEN or self._alive(r["owner_pid"]):
+                continue
+            cur = self._exec("UPDATE jobs SET owner_pid=?, owner_token=?, updated=? WHERE id=? AND owner_token IS ?",
+                             (os.getpid(), self.TOKEN, time.time(), r["id"], r["owner_token"]))
+            if cur.rowcount == 1:   # 동시에 뜬 다른 워커와 경쟁해도 한 곳만 가져간다
+                claimed.append((r["id"], json.loads(r["params"])))
+        return claimed
+
+    def prune(self, cutoff: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.db.execute("DELETE FROM clips WHERE job_id IN (SELECT id FROM jobs WHERE state IN ('completed', 'failed') AND updated < ?)", (cutoff,))
+            self.db.execute("DELETE FROM jobs WHERE state IN ('completed', 'failed') AND updated < ?", (cutoff,))
+
+JOURNAL = JobJournal(JOURNAL_DB)
+
+# ===== 작업 엔진 =====
+class Job:
+    """백그라운드 생성 작업. 상태와 진행 이벤트 로그를 보관한다."""
+    def __init__(self, params: dict, job_id: str = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.params = params
+        self.state = "queued"        # queued | running | completed | failed
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.clips_total = 0
+        self.clips_done = 0
+        self.cache_hits = 0
+        self.shared_clips = 0        # 다른 작업·같은 작업의 동일 컷과 Sora 생성을 공유한 수
+        self.resumed_from = None
+        self.recovered = {}          # 재시작 전 저널에 남은 컷(번호 → 기록)
+        self.stale_refs = set()      # URL 을 캐시·저널에서 가져온 video id — 이를 참조하는 컷은 제출 직전에 URL 을 새로 받는다
+        self.filename = None
+        self.error = None
+        self.events = []
+        self.cond = threading.Condition()
+        self.workdir = os.path.join(SCRATCH_DIR, self.id)
+        self.disk = {"scratch_bytes": 0, "peak_scratch_bytes": 0, "output_bytes": 0}
+        self.timings = {}            # 단계별 누적 시간(초). 파이프라인 단계는 겹치므로 합이 벽시계보다 클 수 있다
+        self.clip_timings = {}       # 컷 번호 → 단계별 시간
+        self.ffmpeg_cpu_sec = 0.0
+        self.stats_lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, clip: int = None):
+        """name 단계 span. 소요 시간을 작업·컷별로 누적하고 히스토그램과 구조화 로그로 내보낸다.
+
+        그 동안 실행된 ffmpeg CPU 는 이 작업에 귀속된다. yield 되는 dict 에 넣은 값은 로그에 함께 남는다.
+        """
+        prev = getattr(_CTX, "job", None)
+        _CTX.job = self
+        span = {}
+        t0 = time.perf_counter()
+        try:
+            yield span
+        finally:
+            dt = time.perf_counter() - t0
+            _CTX.job = prev
+            STAGE_SECONDS.labels(name).observe(dt)
+            with self.stats_lock:
+                self.timings[name] = self.timings.get(name, 0.0) + dt
+                if clip is not None:
+                    per = self.clip_timings.setdefault(clip, {})
+                    per[name] = per.get(name, 0.0) + dt
+            log_event("span", job=self.id, stage=name, clip=clip, sec=round(dt, 3), **span)
+
+    def note_shared(self, shared: bool):
+        if shared:
+            with self.stats_lock:
+                self.shared_clips += 1
+
+    def add_ffmpeg_cpu(self, sec: float):
+        with self.stats_lock:
+            self.ffmpeg_cpu_sec += sec
+
+    def path(self, name: str):
+        """작업 전용 스크래치 폴더 안의 경로."""
+        return os.path.join(self.workdir, name)
+
+    def track_disk(self):
+        used = dir_bytes(self.workdir)
+        self.disk["scratch_bytes"] = used
+        self.disk["peak_scratch_bytes"] = max(self.disk["peak_scratch_bytes"], used)
+
+    def emit(self, kind: str, **data):
+        with self.cond:
+            self.events.append({"seq": len(self.events), "type": kind, "ts": time.time(), **data})
+            self.cond.notify_all()
+
+    @property
+    def terminal(self):
+        return self.state in ("completed", "failed")
+
+    def snapshot(self):
+        return {
+            "id": self.id, "state": self.state,
+            "created": self.created, "started": self.started, "finished": self.finished,
+            "clips_total": self.clips_total, "clips_done": self.clips_done,
+            "cache_hits": self.cache_hits, "shared_clips": self.shared_clips, "resumed_from": self.resumed_from,
+            "filename": self.filename, "error": self.error, "disk": dict(self.disk),
+            "timings": {k: round(v, 3) for k, v in self.timings.items()},
+            "clip_timings": {i: {k: round(v, 3) for k, v in t.items()} for i, t in sorted(self.clip_timings.items())},
+            "ffmpeg_cpu_sec": round(self.ffmpeg_cpu_sec, 3),
+        }
+
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+JOB_POOL = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-job")   # 배치가 대화형 작업 자리를 차지하지 않도록 분리
+
+def _pool(job):
+    return BATCH_POOL if job.params.get("batch") else JOB_POOL
+
+def _prune_jobs():
+    """보관 시간이 지난 종료 작업을 메모리에서 제거."""
+    cutoff = time.time() - JOB_TTL_SEC
+    for jid in [k for k, j in JOBS.items() if j.terminal and (j.finished or 0) < cutoff]:
+        del JOBS[jid]
+    JOURNAL.prune(cutoff)
+
+def submit_job(params: dict):
+    """작업을 대기열에 넣는다. 대화형 대기열이 가득 차면 None.
+
+    배치 작업(params["batch"])은 BATCH_POOL 에서 돌고, 배치가 동시 수를 스스로 제한하므로 한도에 세지 않는다.
+    """
+    with JOBS_LOCK:
+        _prune_jobs()
+        if not params.get("batch"):
+            pending = sum(1 for j in JOBS.values() if not j.terminal and not j.params.get("batch"))
+            if pending >= JOB_WORKERS + JOB_QUEUE_MAX:
+                return None
+        job = Job(params)
+        JOBS[job.id] = job
+    JOURNAL.job(job)
+    job.emit("queued")
+    ensure_gc()
+    _pool(job).submit(_run_job, job)
+    return job
+
+def recover_jobs():
+    """기동 시 저널에서 주인 없는 미완료 작업을 같은 id 로 다시 실행. 되살린 작업 수를 반환.
+
+    이미 제출된 컷은 video id 로 조회를 이어 가고, 후처리까지 끝난 컷은 스크래치의 산출물을 그대로 쓴다.
+    """
+    n = 0
+    for job_id, params in JOURNAL.claim_orphans():
+        job = Job(params, job_id=job_id)
+        job.recovered = JOURNAL.clips(job_id)
+        with JOBS_LOCK:
+            JOBS[job.id] = job
+        job.emit("recovered", clips=len(job.recovered))
+        log_event("job_recovered", job=job.id, clips=len(job.recovered))
+        _pool(job).submit(_run_job, job)
+        n += 1
+    if n:
+        ensure_gc()
+    return n
+
+def _run_job(job: Job):
+    job.state, job.started = "running", time.time()
+    JOURNAL.job(job)
+    job.emit("started")
+    try:
+        os.makedirs(job.workdir, exist_ok=True)
+        job.filename = run_generate(job, **{k: v for k, v in job.params.items() if k != "batch"})
+        job.disk["output_bytes"] = os.path.getsize(os.path.join(OUTPUT_DIR, job.filename))
+        job.state = "completed"
+    except Exception as e:
+        job.error = str(e)
+        job.state = "failed"
+        SUBMITTER.cancel(job.id)   # 아직 제출 안 된 컷은 쿼터를 쓰지 않도록 취소
+    finally:
+        job.track_disk()
+        if not KEEP_SCRATCH:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            job.disk["scratch_bytes"] = 0
+    job.finished = time.time()
+    JOURNAL.job(job)
+    JOBS_TOTAL.labels(job.state).inc()
+    log_event("job_" + job.state, job=job.id, sec=round(job.finished - job.started, 3),
+              clips=job.clips_total, cache_hits=job.cache_hits, error=job.error)
+    job.emit(job.state, filename=job.filename, error=job.error)
+
+def parse_generate_params(data: dict, trusted: bool = False):
+    """/generate 요청 본문을 파이프라인 인자로 정규화. trusted 가 아니면 priority 는 0 을 넘지 못한다."""
+    return {
+        "total_length": int(data.get("total_length", 60)),
+        "ratio":   data.get("ratio", "9:16"),
+        "lang":    data.get("lang", "ko-KR"),
+        "inherit": data.get("inherit", "strong"),
+        "voice":   data.get("voice", "female_calm"),
+        "global_prompt": data.get("global_prompt", ""),
+        "scenario":   list(data.get("scenario") or []),
+        "characters": list(data.get("characters") or []),
+        "use_bgm": data.get("use_bgm", "no"),
+        "bgm_url": data.get("bgm_url", ""),
+        "bgm_vol": float(data.get("bgm_vol", 0.25)),
+        "user":     str(data.get("user") or "anonymous"),
+        "priority": int(data.get("priority", 0)) if trusted else min(int(data.get("priority", 0)), 0),
+        "strategy": data.get("strategy") if data.get("strategy") in STRATEGIES else "chain",
+    }
+
+def normalize_scenario(scenario: list, total_length: int, cut_sec: int):
+    """총 길이에 맞춰 컷 수를 맞춘다(부족하면 마지막 장면을 이어지는 부분으로 반복, 넘치면 자름)."""
+    scenario = list(scenario)
+    cut_count = max(1, math.ceil(total_length / cut_sec))
+    if len(scenario) < cut_count:
+        last = scenario[-1] if scenario else "Continue the story."
+        pad = cut_count - len(scenario)
+        first = 2 if scenario else 1
+        # 채운 컷마다 본문이 달라야 parallel/anchored 에서 한 생성으로 묶여 같은 클립이 반복되지 않는다.
+        # 총 개수는 넣지 않아야 길이를 늘려 다시 만들 때 앞쪽 컷의 캐시를 그대로 쓴다
+        scenario += [f"{last} (continuation, part {k})" for k in range(first, first + pad)]
+    elif len(scenario) > cut_count:
+        scenario = scenario[:cut_count]
+    return scenario
+
+# chain: 직전 컷을 remix/참조로 이어 생성 | parallel: 캐릭터 참조만으로 모든 컷 동시 생성
+# anchored: 첫 컷(앵커)을 만든 뒤 나머지를 모두 앵커에서 동시에 파생
+STRATEGIES = ("chain", "parallel", "anchored")
+
+def _remix_source(strategy: str, i: int, prev, anchor):
+    """컷 i 가 remix_id/ref_url 로 참조할 (video id, url)."""
+    if strategy == "parallel":
+        return None, None
+    if strategy == "anchored" and i > 1:
+        return anchor
+    return prev
+
+def first_uncached_clip(params: dict):
+    """캐시된 컷을 따라가며 처음으로 Sora 생성이 필요한 컷 번호(1부터). 모두 캐시면 컷 수 + 1."""
+    cut_sec = resolve_cut_sec()
+    scenario = normalize_scenario(params["scenario"], params["total_length"], cut_sec)
+    strategy = params.get("strategy", "chain")
+    prev = anchor = (None, None)
+    for i, text in enumerate(scenario, 1):
+        remix_id, ref_url = _remix_source(strategy, i, prev, anchor)
+        hit = CLIP_CACHE.get(CLIP_CACHE.key(build_clip_body(
+            text, params["ratio"], cut_sec, params["characters"], params["voice"], params["lang"],
+            global_prompt=params["global_prompt"], remix_id=remix_id, ref_url=ref_url, inherit=params["inherit"])))
+        if not hit:
+            return i
+        prev = (hit["video_id"], hit["url"])
+        if i == 1:
+            anchor = prev
+    return len(scenario) + 1
+
+def _cached_clip(job: Job, pipe: ClipPipeline, i: int, key: str, hit: dict, cut_sec: int):
+    """캐시 적중 처리. 로컬 파일이 없으면 같은 video id 를 다시 받는다. 원격도 사라졌으면 False."""
+    JOURNAL.clip(job.id, i, key=key, video_id=hit["video_id"], url=hit["url"], status="generated")
+    with job.stage("cache", clip=i):
+        clip = CLIP_CACHE.fetch(key, job.path(f"clip_{i}.mp4"))
+    job.stale_refs.add(hit["video_id"])
+    if clip:
+        pipe.add_ready(i, clip)
+    else:
+        try:
+            with job.stage("sora_wait", clip=i):
+                fresh = wait_done(hit["video_id"], cut_sec, job=job.id, clip=i)
+        except Exception:
+            return False
+        pipe.put(i, hit["url"], hit["video_id"], key, download_url=fresh)
+    job.cache_hits += 1
+    job.emit("clip_cached", clip=i, video_id=hit["video_id"], local=bool(clip))
+    return True
+
+def _generate_one(job: Job, pipe: ClipPipeline, i: int, body: dict, cut_sec: int, user: str, priority: int):
+    """컷 하나를 (저널·캐시 또는 Sora 로) 만들어 파이프라인에 넘기고 (video id, url) 반환."""
+    key = CLIP_CACHE.key(body)
+    rec = _journaled_clip(job, i, key)
+    if rec and rec["status"] == "ready":
+        pipe.add_ready(i, {"path": rec["path"], "blur": rec["blur"]})
+        job.stale_refs.add(rec["video_id"])
+        return rec["video_id"], rec["url"]
+    if rec:
+        try:
+            with job.stage("sora_wait", clip=i):
+                url = wait_done(rec["video_id"], cut_sec, job=job.id, clip=i)
+        except Exception as e:
+            log_event("journal_clip_lost", job=job.id, clip=i, video_id=rec["video_id"], error=str(e))
+        else:
+            if rec["url"]:
+                # 생성 완료로 기록된 컷: 다음 컷의 참조(와 그 키)는 기록된 URL 그대로 두고 받기만 새 URL 로
+                pipe.put(i, rec["url"], rec["video_id"], key, download_url=url)
+                job.stale_refs.add(rec["video_id"])
+                return rec["video_id"], rec["url"]
+            return _clip_generated(job, pipe, i, key, rec["video_id"], url)
+    hit = CLIP_CACHE.get(key)
+    if hit and _cached_clip(job, pipe, i, key, hit, cut_sec):
+        return hit["video_id"], hit["url"]
+    fut, eta, shared = submit_clip(body, user=user, priority=priority, refresh_ref=body.get("remix_id") in job.stale_refs,
+                                   job=job.id, clip=i)
+    job.note_shared(shared)
+    job.emit("clip_queued", clip=i, eta=round(eta, 1), shared=shared)
+    with job.stage("sora_submit", clip=i) as span:   # 스케줄러 대기 + 생성 요청
+        vid = span["video_id"] = fut.result()
+    _clip_submitted(job, i, key, vid)
+    with job.stage("sora_wait", clip=i):
+        url = wait_done(vid, cut_sec, job=job.id, clip=i)
+    return _clip_generated(job, pipe, i, key, vid, url)
+
+def _journaled_clip(job: Job, i: int, key: str):
+    """재시작 전에 이미 제출된 컷 i 의 저널 기록. 본문이 달라졌거나 쓸 수 없으면 None."""
+    rec = job.recovered.pop(i, None)
+    if not rec or rec["key"] != key or not rec["video_id"]:
+        return None
+    if rec["status"] == "ready" and not (rec["path"] and os.path.exists(rec["path"])):
+        rec["status"] = "generated"   # 산출물이 사라졌으면 다시 받는다
+    if rec["status"] == "ready":
+        rec["blur"] = tuple(rec["blur"]) if rec["blur"] else None
+    job.emit("clip_recovered", clip=i, video_id=rec["video_id"], status=rec["status"])
+    return rec
+
+def _clip_submitted(job: Job, i: int, key: str, vid: str):
+    JOURNAL.clip(job.id, i, key=key, video_id=vid, status="submitted")
+    job.emit("clip_submitted", clip=i, video_id=vid)
+
+def _clip_generated(job: Job, pipe: ClipPipeline, i: int, key: str, vid: str, url: str):
+    JOURNAL.clip(job.id, i, key=key, video_id=vid, url=url, status="generated")
+    job.emit("clip_generated", clip=i, video_id=vid)
+    pipe.put(i, url, vid, key)
+    return vid, url
+
+def _generate_fanout(job: Job, pipe: ClipPipeline, items: list, cut_sec: int, user: str, priority: int):
+    """서로 의존하지 않는 컷 [(i, body)] 를 한꺼번에 제출하고, 끝나는 순서대로 파이프라인에 넘긴다.
+
+    같은 본문의 컷은 같은 Future 를 받으므로 Future 마다 기다리는 컷 목록을 둔다.
+    저널에서 되살린 video id 는 조회만 다시 하고, 원격에서 사라졌으면 새로 제출한다.
+    """
+    pending, bodies = {}, dict(items)
+
+    def submit(i, key):
+        fut, eta, shared = submit_clip(bodies[i], user=user, priority=priority,
+                                       refresh_ref=bodies[i].get("remix_id") in job.stale_refs, job=job.id, clip=i)
+        job.note_shared(shared)
+        job.emit("clip_queued", clip=i, eta=round(eta, 1), shared=shared)
+        pending.setdefault(fut, []).append(("submit", i, key, None))
+
+    for i, body in items:
+        key = CLIP_CACHE.key(body)
+        rec = _journaled_clip(job, i, key)
+        if rec and rec["status"] == "ready":
+            pipe.add_ready(i, {"path": rec["path"], "blur": rec["blur"]})
+            continue
+        if rec:
+            pending.setdefault(POLLER.track(rec["video_id"], cut_sec, job=job.id, clip=i), []).append(
+                ("recovered", i, key, rec["video_id"]))
+            continue
+        hit = CLIP_CACHE.get(key)
+        if hit and _cached_clip(job, pipe, i, key, hit, cut_sec):
+            continue
+        submit(i, key)
+    with job.stage("sora_fanout"):
+        while pending:
+            done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                for kind, i, key, vid in pending.pop(f):
+                    if kind == "submit":
+                        vid = f.result()
+                        _clip_submitted(job, i, key, vid)
+                        pending.setdefault(POLLER.track(vid, cut_sec, job=job.id, clip=i), []).append(("poll", i, key, vid))
+                    elif kind == "recovered" and f.exception() is not None:
+                        log_event("journal_clip_lost", job=job.id, clip=i, video_id=vid, error=str(f.exception()))
+                        submit(i, key)
+                    else:
+                        _clip_generated(job, pipe, i, key, vid, f.result())
+
+def run_generate(job: Job, total_length, ratio, lang, inherit, voice, global_prompt,
+                 scenario, characters, use_bgm, bgm_url, bgm_vol, user="anonymous", priority=0,
+                 strategy="chain"):
+    """컷 생성 → 다운로드 → 워터마크 흐림 → 스티칭 → BGM. 최종 파일명을 반환."""
+    cut_sec  = resolve_cut_sec()
+    scenario = normalize_scenario(scenario, total_length, cut_sec)
+    job.clips_total = len(scenario)
+
+    def body_for(i, text, remix):
+        return build_clip_body(text, ratio, cut_sec, characters, voice, lang,
+                               global_prompt=global_prompt, remix_id=remix[0], ref_url=remix[1], inherit=inherit)
+
+    # 다운로드·흐림은 파이프라인에서 Sora 생성과 겹쳐 실행
+    with ClipPipeline(job) as pipe:
+        if strategy == "chain":
+            # 컷 i+1 은 컷 i 의 vid/url 만 필요
+            prev = (None, None)
+            for i, text in enumerate(scenario, 1):
+                prev = _generate_one(job, pipe, i, body_for(i, text, prev), cut_sec, user, priority)
+        else:
+            anchor, start = (None, None), 1
+            if strategy == "anchored":
+                anchor = _generate_one(job, pipe, 1, body_for(1, scenario[0], anchor), cut_sec, user, priority)
+                start = 2
+            items = [(i, body_for(i, text, _remix_source(strategy, i, None, anchor)))
+                     for i, text in enumerate(scenario[start - 1:], start)]
+            _generate_fanout(job, pipe, items, cut_sec, user, priority)
+    outputs = pipe.outputs()
+
+    bgm_file = None
+    if use_bgm == "yes" and bgm_url:
+        job.emit("stage", stage="bgm")
+        with job.stage("bgm") as span:
+            bgm_file = BGM_CACHE.get(bgm_url, job, span)
+
+    # 최종 파일은 스크래치에 만든 뒤 완성되면 결과물 저장소로 옮긴다
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    final_name = f"output_final_{ts}_{job.id}.mp4"
+    tmp_out = job.path(final_name)
+    with job.stage("finish"):
+        if FINISH_MODE == "legacy":
+            finish_legacy(job, outputs, tmp_out, bgm_file, bgm_vol)
+        else:
+            job.emit("stage", stage="finish")
+            finish_single(job, outputs, tmp_out, bgm_file, bgm_vol)
+    job.track_disk()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    shutil.move(tmp_out, os.path.join(OUTPUT_DIR, final_name))
+    return final_name
+
+def priority_trusted():
+    """PRIORITY_TOKEN 이 설정되어 있고 요청의 X-Priority-Token 이 일치하면 True."""
+    token = request.headers.get("X-Priority-Token", "")
+    return bool(PRIORITY_TOKEN) and hmac.compare_digest(token.encode(), PRIORITY_TOKEN.encode())
+
+@app.route("/generate", methods=["POST"])
+def generate():
+    try:
+        data = request.get_json(force=True)
+        # 공정 큐잉 단위: 본문 user → X-User 헤더 → 접속 IP
+        data.setdefault("user", request.headers.get("X-User") or request.remote_addr)
+        params = parse_generate_params(data, trusted=priority_trusted())
+        job = submit_job(params)
+        if job is None:
+            return jsonify({"status":"error","message":"작업 대기열이 가득 찼습니다. 잠시 후 다시 시도하세요."}), 503
+        return jsonify({
+            "status":"success", "job_id": job.id,
+            "status_url": f"/jobs/{job.id}", "events_url": f"/jobs/{job.id}/events",
+            "preview_url": f"/jobs/{job.id}/hls/{HlsPreview.PLAYLIST}" if HLS_PREVIEW else None
+        }), 202
     except Exception as e:
         return jsonify({"status":"error","message":str(e)}), 500
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        # 재시작 이전에 끝난 작업은 저널 기록으로 응답
+        snap = JOURNAL.snapshot(job_id)
+        if snap is None:
+            return jsonify({"status":"error","message":"job not found"}), 404
+        return jsonify({"status":"success","job": snap})
+    return jsonify({"status":"success","job": job.snapshot()})
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+def job_resume(job_id):
+    """실패한 작업을 같은 입력으로 다시 실행. 캐시된 컷은 건너뛰고 첫 미캐시 컷부터 생성."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"status":"error","message":"job not found"}), 404
+    if not job.terminal:
+        return jsonify({"status":"error","message":"job is still running"}), 409
+    resume_from = first_uncached_clip(job.params)
+    new_job = submit_job(job.params)
+    if new_job is None:
+        return jsonify({"status":"error","message":"작업 대기열이 가득 찼습니다. 잠시 후 다시 시도하세요."}), 503
+    new_job.resumed_from = resume_from
+    return jsonify({
+        "status":"success", "job_id": new_job.id, "resume_from": resume_from,
+        "status_url": f"/jobs/{new_job.id}", "events_url": f"/jobs/{new_job.id}/events",
+        "preview_url": f"/jobs/{new_job.id}/hls/{HlsPreview.PLAYLIST}" if HLS_PREVIEW else None
+    }), 202
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """진행 이벤트 SSE 스트림. Last-Event-ID 로 재접속 시 이어받기.
+
+    이벤트 id 는 '<기동 토큰>:<seq>' 이므로 재시작 후 되살린 작업에 재접속하면 처음부터 다시 받는다.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"status":"error","message":"job not found"}), 404
+    boot = JobJournal.TOKEN[:8]
+    tok, _, last = request.headers.get("Last-Event-ID", "").rpartition(":")
+    start = int(last) + 1 if tok == boot and last.isdigit() else 0
+
+    def stream():
+        seq = start
+        while True:
+            with job.cond:
+                if seq >= len(job.events):
+                    job.cond.wait(timeout=15)
+                pending = job.events[seq:]
+            if not pending:
+                yield ": keep-alive\n\n"
+                continue
+            for ev in pending:
+                yield f"id: {boot}:{ev['seq']}\nevent: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+                if ev["type"] in ("completed", "failed"):
+                    return
+            seq = pending[-1]["seq"] + 1
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/jobs/<job_id>/hls/<filename>")
+def job_hls(job_id, filename):
+    """작업 진행 중 HLS 미리보기. 재생목록은 계속 바뀌므로 캐시하지 않는다."""
+    job = JOBS.get(job_id)
+    if job is None or not HLS_PREVIEW:
+        return jsonify({"status":"error","message":"job not found"}), 404
+    if not filename.endswith((".m3u8", ".ts")):
+        abort(404)
+    resp = send_from_directory(os.path.join(job.workdir, "hls"), filename,
+                               mimetype="application/vnd.apple.mpegurl" if filename.endswith(".m3u8") else "video/mp2t",
+                               max_age=0 if filename.endswith(".m3u8") else MEDIA_MAX_AGE)
+    if filename.endswith(".m3u8"):
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+# ===== 일괄 생성 =====
+BATCH_FIELDS = ("topic", "total_length", "cuts", "ratio", "lang", "voice", "inherit", "strategy", "characters",
+                "global_prompt", "use_bgm", "bgm_url", "bgm_vol", "priority")
+
+def parse_batch_rows(text: str, fmt: str):
+    """JSONL 또는 CSV 본문을 행 dict 목록으로. CSV 의 characters 는 JSON 배열이나 '이름;이름'."""
+    if fmt == "csv":
+        rows = [dict(r) for r in csv.DictReader(io.StringIO(text))]
+        for r in rows:
+            chars = (r.get("characters") or "").strip()
+            if chars.startswith("["):
+                r["characters"] = json.loads(chars)
+            elif chars:
+                r["characters"] = [{"name": n.strip()} for n in chars.split(";") if n.strip()]
+            else:
+                r.pop("characters", None)
+        return rows
+    rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not all(isinstance(r, dict) for r in rows):
+        raise ValueError("each line must be a JSON object")
+    return rows
+
+def batch_item_params(row: dict, user: str, batch_id: str):
+    """행 하나 → 자동 시나리오 → /generate 와 같은 작업 인자(배치 풀·낮은 제출 우선순위)."""
+    row = {k: v for k, v in row.items() if k in BATCH_FIELDS and v not in (None, "")}
+    if not row.get("topic"):
+        raise ValueError("topic is required")
+    chars = row.get("characters")
+    if chars is not None and not (isinstance(chars, list) and all(isinstance(c, dict) and c.get("name") for c in chars)):
+        raise ValueError("characters must be a list of objects with a name")
+    total_length = int(row.get("total_length", 60))
+    script = make_script(row["topic"], total_length, row.get("cuts"))
+    params = parse_generate_params({**row, "total_length": total_length, "scenario": script["scenario"],
+                                    "characters": chars or script["characters"], "user": user})
+    params["priority"] = min(params["priority"], BATCH_PRIORITY)
+    params["batch"] = batch_id
+    return params
+
+class Batch:
+    """여러 주제를 한 번에 생성하는 묶음. 행마다 작업을 하나씩 만들어 BATCH_CONCURRENCY 개씩 돌린다.
+
+    작업은 배치 전용 풀(BATCH_WORKERS)에서 돌고 컷은 BATCH_PRIORITY 이하로 제출되므로
+    대화형 작업의 실행 자리와 Sora 제출 순서를 밀어내지 않는다. 같은 장면은 single-flight 와
+    컷 캐시로 한 번만 생성된다.
+    """
+    def __init__(self, rows: list, user: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.user = user
+        self.created = time.time()
+        self.finished = None
+        self.items = []
+        for n, row in enumerate(rows, 1):
+            item = {"row": n, "topic": row.get("topic"), "state": "pending", "job_id": None, "error": None, "params": None}
+            try:
+                item["params"] = batch_item_params(row, user, self.id)
+            except Exception as e:
+                item.update(state="invalid", error=str(e))
+            self.items.append(item)
+        self.thread = threading.Thread(target=self._run, name=f"batch-{self.id}", daemon=True)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix=f"batch-{self.id}") as ex:
+            for item in self.items:
+                if item["params"] is not None:
+                    ex.submit(self._run_item, item)
+        self.finished = time.time()
+        log_event("batch_finished", batch=self.id, sec=round(self.finished - self.created, 3), **self.summary())
+
+    def _run_item(self, item: dict):
+        job = submit_job(item["params"])   # 배치 작업은 대화형 대기열 한도에 걸리지 않는다
+        item["job_id"] = job.id
+        with job.cond:
+            job.cond.wait_for(lambda: job.terminal)
+        item["state"] = job.state   # 작업이 JOBS 에서 정리된 뒤에도 상태는 남긴다
+
+    def _job(self, item: dict):
+        return JOBS.get(item["job_id"]) if item["job_id"] else None
+
+    def item_status(self, item: dict):
+        job = self._job(item)
+        out = {k: item[k] for k in ("row", "topic", "job_id", "error")}
+        out["state"] = job.state if job else item["state"]
+        if job:
+            out.update(clips_done=job.clips_done, clips_total=job.clips_total, cache_hits=job.cache_hits,
+                       shared_clips=job.shared_clips, filename=job.filename, error=job.error,
+                       sec=round((job.finished or time.time()) - job.started, 3) if job.started else None)
+        return out
+
+    def summary(self):
+        """집계 처리량: 상태별 수, 컷 수, 만든 영상 길이, 분당 처리량, 단계별 누적 시간."""
+        states, stages = {}, {}
+        clips_total = clips_done = hits = shared = video_sec = 0
+        cpu = 0.0
+        for item in self.items:
+            job = self._job(item)
+            st = job.state if job else item["state"]
+            states[st] = states.get(st, 0) + 1
+            if not job:
+                continue
+            clips_total += job.clips_total
+            clips_done += job.clips_done
+            hits += job.cache_hits
+            shared += job.shared_clips
+            cpu += job.ffmpeg_cpu_sec
+            if job.state == "completed":
+                video_sec += job.params["total_length"]
+            for k, v in job.timings.items():
+                stages[k] = stages.get(k, 0.0) + v
+        wall = (self.finished or time.time()) - self.created
+        per_min = 60.0 / max(wall, 1e-6)
+        return {
+            "items": len(self.items), "states": states,
+            "clips_total": clips_total, "clips_done": clips_done, "cache_hits": hits, "shared_clips": shared,
+            "wall_sec": round(wall, 3), "video_sec": video_sec,
+            "videos_per_hour": round(states.get("completed", 0) * per_min * 60, 2),
+            "video_sec_per_min": round(video_sec * per_min, 2),
+            "clips_per_min": round(clips_done * per_min, 2),
+            "ffmpeg_cpu_sec": round(cpu, 3),
+            "stage_sec": {k: round(v, 3) for k, v in sorted(stages.items())},
+        }
+
+    def report(self):
+        return {"id": self.id, "user": self.user, "created": self.created, "finished": self.finished,
+                "summary": self.summary(), "items": [self.item_status(i) for i in self.items]}
+
+BATCHES = {}
+
+def _prune_batches():
+    cutoff = time.time() - JOB_TTL_SEC
+    for bid in [k for k, b in BATCHES.items() if b.finished and b.finished < cutoff]:
+        del BATCHES[bid]
+
+@app.route("/batch", methods=["POST"])
+def batch_create():
+    """JSONL(기본) 또는 CSV(Content-Type text/csv, ?format=csv, .csv 업로드) 로 주제 목록을 받아 일괄 생성."""
+    try:
+        # files 를 읽으면 폼 본문이 소비되므로 multipart 일 때만
+        upload = request.files.get("file") if request.mimetype == "multipart/form-data" else None
+        text = upload.read().decode("utf-8-sig") if upload else request.get_data(as_text=True)
+        fmt = request.args.get("format") or ("csv" if "csv" in (request.mimetype or "")
+                                             or (upload and upload.filename.lower().endswith(".csv")) else "jsonl")
+        try:
+            rows = parse_batch_rows(text.lstrip("\ufeff"), fmt)
+        except (ValueError, csv.Error) as e:
+            return jsonify({"status":"error","message":f"invalid {fmt}: {e}"}), 400
+        if not rows:
+            return jsonify({"status":"error","message":"no rows"}), 400
+        if len(rows) > BATCH_MAX_ITEMS:
+            return jsonify({"status":"error","message":f"too many rows (max {BATCH_MAX_ITEMS})"}), 400
+        user = request.args.get("user") or request.headers.get("X-User") or request.remote_addr
+        batch = Batch(rows, user)
+        if all(i["params"] is None for i in batch.items):
+            return jsonify({"status":"error","message":"no valid rows",
+                            "items": [batch.item_status(i) for i in batch.items]}), 400
+        _prune_batches()
+        BATCHES[batch.id] = batch
+        batch.thread.start()
+        return jsonify({"status":"success", "batch_id": batch.id, "status_url": f"/batch/{batch.id}",
+                        "items": len(batch.items), "invalid": sum(1 for i in batch.items if i["params"] is None)}), 202
+    except Exception as e:
+        return jsonify({"status":"error","message":str(e)}), 500
+
+@app.route("/batch/<batch_id>")
+def batch_status(batch_id):
+    batch = BATCHES.get(batch_id)
+    if batch is None:
+        return jsonify({"status":"error","message":"batch not found"}), 404
+    return jsonify({"status":"success","batch": batch.report()})
+
+def _inflight_jobs():
+    return sum(1 for j in list(JOBS.values()) if j.state == "running")
+
+def _queued_clips():
+    return sum(max(0, j.clips_total - j.clips_done) for j in list(JOBS.values()) if not j.terminal)
+
+Gauge("aistudio_jobs_inflight", "실행 중인 작업 수").set_function(_inflight_jobs)
+Gauge("aistudio_jobs_queued", "대기 중인 작업 수").set_function(
+    lambda: sum(1 for j in list(JOBS.values()) if j.state == "queued"))
+Gauge("aistudio_clips_queued", "진행 중 작업에서 아직 끝나지 않은 컷 수").set_function(_queued_clips)
+Gauge("aistudio_scratch_bytes", "스크래치 디스크 사용량").set_function(lambda: dir_bytes(SCRATCH_DIR))
+
+Gauge("aistudio_submit_queue_depth", "Sora 제출 대기 컷 수").set_function(
+    lambda: sum(len(q) for uu in list(SUBMITTER.queues.values()) for q in list(uu.values())))
+Gauge("aistudio_submit_inflight", "Sora 에서 생성 중인 컷 수").set_function(lambda: SUBMITTER.inflight)
+Gauge("aistudio_encode_queue_depth", "인코딩 슬롯 대기 수").set_function(lambda: len(ENCODER.waiting))
+Gauge("aistudio_encode_slots_busy", "사용 중인 인코딩 슬롯 수").set_function(lambda: ENCODER.busy)
+
+@app.route("/scheduler")
+def scheduler_stats():
+    """인코딩·Sora 제출 스케줄러 상태(슬롯, 대기열 깊이, 누적 대기, 컷별 예상 시작 시각)."""
+    return jsonify({"status":"success", "encode": ENCODER.stats(), "submit": SUBMITTER.stats()})
+
+@app.route("/metrics")
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route("/storage")
+def storage_stats():
+    """스크래치·결과물·캐시 디스크 사용량."""
+    return jsonify({
+        "status":"success",
+        "scratch_bytes": dir_bytes(SCRATCH_DIR),
+        "output_bytes": dir_bytes(OUTPUT_DIR),
+        "clip_cache": CLIP_CACHE.stats(),
+        "bgm_cache": BGM_CACHE.stats(),
+        "jobs": {jid: j.disk for jid, j in list(JOBS.items())},
+    })
+
+def serve_output(filename: str, as_attachment: bool):
+    """결과물 저장소 안의 파일만 제공. Range·ETag·Last-Modified 조건부 요청 지원.
+
+    X_ACCEL_PREFIX 가 있으면 nginx 에 X-Accel-Redirect 로 넘기고, 아니면 WSGI 서버의
+    file_wrapper(gunicorn 은 sendfile) 로 전송한다. 단 Range(206) 응답은 werkzeug 가 파일을
+    감싸 파이썬에서 읽어 보내므로 sendfile 이 적용되지 않는다 — 탐색까지 무복사로 보내려면
+    X_ACCEL_PREFIX 가 필요하다.
+    """
+    if X_ACCEL_PREFIX:
+        path = safe_join(OUTPUT_DIR, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        resp = Response(mimetype="video/mp4" if filename.endswith(".mp4") else None)
+        resp.headers["X-Accel-Redirect"] = f"{X_ACCEL_PREFIX}/{filename}"
+        if as_attachment:
+            resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return resp
+    return send_from_directory(OUTPUT_DIR, filename, as_attachment=as_attachment,
+                               conditional=True, etag=True, max_age=MEDIA_MAX_AGE)
+
+def http_error_json(e: HTTPException):
+    """HTTPException 을 상태 코드와 헤더(416 의 Content-Range 등)를 살린 JSON 오류로 바꾼다."""
+    resp = jsonify({"status":"error","message":e.description})
+    resp.status_code = e.code
+    for k, v in e.get_headers():
+        if k.lower() != "content-type":
+            resp.headers[k] = v
+    return resp
+
 @app.route("/download/<filename>")
 def download_file(filename):
     try:
-        return send_file(filename, as_attachment=True)
-    except Exception as e:
-        return jsonify({"status":"error","message":str(e)}), 404
+        return serve_output(filename, as_attachment=True)
+    except HTTPException as e:
+        return http_error_json(e)
+
+@app.route("/media/<filename>")
+def media_file(filename):
+    """<video> 재생용 인라인 전송. 탐색(seek) 시 Range 요청으로 필요한 부분만 보낸다."""
+    try:
+        return serve_output(filename, as_attachment=False)
+    except HTTPException as e:
+        return http_error_json(e)
 
 if __name__ == "__main__":
+    # 개발용 서버. 운영은 gunicorn -c gunicorn.conf.py app:app
     port = int(os.getenv("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "0") == "1"
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":   # 리로더 감시 프로세스에서는 되살리지 않음
+        recover_jobs()
+    app.run(host="0.0.0.0", port=port, debug=debug, threaded=True)
@@ -0,0 +1,180 @@
+"""가짜 Sora 서버를 상대로 한 종단간 벤치마크.
+
+플랜(PLUS/PRO 컷 길이) × 총 길이(60/180/480초) × 동시 작업 수 조합마다
+/autoscript → /generate 를 실행하고 작업이 끝날 때까지 기다린 뒤
+벽시계 시간, 단계별 시간, ffmpeg CPU 초, 최대 디스크 사용량을 표로 출력한다.
+
+실행 예:
+  python bench.py                              # 기본 전체 조합
+  python bench.py --lengths 60 --concurrency 1 4 --plans PLUS --json bench.json
+  python bench.py --submit-rate 0                 # 플랜 기본 제출 한도 그대로(실제 쿼터 흉내)
+
+기본으로는 앱의 제출 한도(SUBMIT_*)를 크게 풀어 파이프라인 처리량만 잰다.
+"""
+import os, sys, time, json, socket, argparse, subprocess, tempfile, shutil, threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_http(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"서버 응답 없음: {url}")
+
+def dir_bytes(root: str):
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+class DiskSampler(threading.Thread):
+    """스크래치+결과물 폴더 사용량을 주기적으로 재서 최댓값을 기록."""
+    def __init__(self, roots, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.roots, self.interval = roots, interval
+        self.peak = 0
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, sum(dir_bytes(r) for r in self.roots))
+            self.stop.wait(self.interval)
+
+def start_app(plan: str, sora_url: str, workdir: str, workers: int, extra_env: dict):
+    port = free_port()
+    env = dict(os.environ, PLAN=plan, SORA_BASE_URL=sora_url, SORA_TOKEN="fake", PORT=str(port),
+               SCRATCH_DIR=os.path.join(workdir, "scratch"), OUTPUT_DIR=os.path.join(workdir, "outputs"),
+               CLIP_CACHE_DIR="", JOB_WORKERS=str(workers))
+    env.update(extra_env)
+    env.pop("CUT_SEC", None)
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "app.py")], env=env, cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    wait_http(base + "/")
+    return proc, base
+
+def run_one(base: str, length: int, ratio: str):
+    """한 건: 시나리오 자동 생성 → 생성 요청 → 완료까지 폴링."""
+    t0 = time.time()
+    sc = requests.post(base + "/autoscript", data={"topic": "벤치마크", "total_length": length,
+                                                   "ratio": ratio, "lang": "ko-KR"}).json()
+    payload = {"total_length": length, "ratio": ratio, "scenario": sc["scenario"],
+               "characters": sc["characters"], "use_bgm": "no"}
+    r = requests.post(base + "/generate", json=payload).json()
+    if r.get("status") != "success":
+        return {"state": "rejected", "error": r.get("message"), "wall_sec": time.time() - t0}
+    while True:
+        job = requests.get(base + r["status_url"]).json()["job"]
+        if job["state"] in ("completed", "failed"):
+            job["wall_sec"] = time.time() - t0
+            return job
+        time.sleep(0.5)
+
+def run_case(base: str, length: int, concurrency: int, ratio: str, roots):
+    sampler = DiskSampler(roots)
+    sampler.start()
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        jobs = list(ex.map(lambda _: run_one(base, length, ratio), range(concurrency)))
+    wall = time.time() - t0
+    sampler.stop.set()
+    sampler.join()
+    stages = {}
+    for j in jobs:
+        for k, v in (j.get("timings") or {}).items():
+            stages[k] = stages.get(k, 0.0) + v
+    done = [j for j in jobs if j.get("state") == "completed"]
+    return {
+        "length": length, "concurrency": concurrency,
+        "ok": len(done), "failed": len(jobs) - len(done),
+        "wall_sec": round(wall, 2),
+        "job_wall_sec_avg": round(sum(j["wall_sec"] for j in jobs) / len(jobs), 2),
+        "stage_sec": {k: round(v / len(jobs), 2) for k, v in sorted(stages.items())},
+        "ffmpeg_cpu_sec": round(sum(j.get("ffmpeg_cpu_sec", 0) for j in jobs), 2),
+        "peak_disk_bytes": sampler.peak,
+        "peak_job_scratch_bytes": max((j.get("disk", {}).get("peak_scratch_bytes", 0) for j in jobs), default=0),
+        "errors": [j.get("error") for j in jobs if j.get("error")][:3],
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="AI-Studio 종단간 벤치마크 (가짜 Sora 사용)")
+    ap.add_argument("--plans", nargs="+", default=["PLUS", "PRO"])
+    ap.add_argument("--lengths", nargs="+", type=int, default=[60, 180, 480])
+    ap.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    ap.add_argument("--ratio", default="9:16")
+    ap.add_argument("--sora-url", help="이미 떠 있는 가짜 Sora 주소 (없으면 직접 띄움)")
+    ap.add_argument("--gen-per-sec", type=float, default=0.2, help="가짜 Sora 영상 1초당 생성 시간")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--submit-rate", type=float, default=6000, help="앱 SUBMIT_RATE_PER_MIN (0 이면 플랜 기본값)")
+    ap.add_argument("--submit-burst", type=int, default=1000, help="앱 SUBMIT_BURST (0 이면 플랜 기본값)")
+    ap.add_argument("--submit-inflight", type=int, default=1000, help="앱 SUBMIT_MAX_INFLIGHT (0 이면 플랜 기본값)")
+    ap.add_argument("--env", nargs="*", default=[], help="앱에 넘길 추가 ENV (KEY=VALUE)")
+    ap.add_argument("--json", help="결과를 JSON 파일로도 저장")
+    args = ap.parse_args()
+    # 제출 한도 플래그 → ENV (0 은 앱에서 플랜 기본값). --env 로 준 값이 우선
+    extra_env = {"SUBMIT_RATE_PER_MIN": str(args.submit_rate), "SUBMIT_BURST": str(args.submit_burst),
+                 "SUBMIT_MAX_INFLIGHT": str(args.submit_inflight)}
+    extra_env.update(kv.split("=", 1) for kv in args.env)
+
+    fake = None
+    sora_url = args.sora_url
+    if not sora_url:
+        port = free_port()
+        fake = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_sora.py"), "--port", str(port),
+                                 "--gen-per-sec", str(args.gen_per_sec), "--fail-rate", str(args.fail_rate),
+                                 "--rate-429", str(args.rate_429)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sora_url = f"http://127.0.0.1:{port}/v1/videos"
+        wait_http(f"http://127.0.0.1:{port}/v1/videos/none")
+
+    results = []
+    try:
+        for plan in args.plans:
+            workdir = tempfile.mkdtemp(prefix=f"bench_{plan}_")
+            proc, base = start_app(plan, sora_url, workdir, max(args.concurrency), extra_env)
+            roots = [os.path.join(workdir, "scratch"), os.path.join(workdir, "outputs")]
+            try:
+                for length in args.lengths:
+                    for c in args.concurrency:
+                        res = run_case(base, length, c, args.ratio, roots)
+                        res["plan"] = plan
+                        results.append(res)
+                        print(f"{plan:<4} {length:>4}s x{c:<2} ok={res['ok']} fail={res['failed']} "
+                              f"wall={res['wall_sec']:>8.1f}s job_avg={res['job_wall_sec_avg']:>8.1f}s "
+                              f"ffmpeg_cpu={res['ffmpeg_cpu_sec']:>8.1f}s "
+                              f"peak_disk={res['peak_disk_bytes'] / (1 << 20):>8.1f}MiB  {res['stage_sec']}",
+                              flush=True)
+                        for d in roots[1:]:
+                            shutil.rmtree(d, ignore_errors=True)
+                            os.makedirs(d, exist_ok=True)
+            finally:
+                proc.terminate()
+                proc.wait()
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        if fake:
+            fake.terminate()
+            fake.wait()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
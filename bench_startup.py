@@ -0,0 +1,121 @@
+"""콜드 스타트 측정: 모듈 import 시간, 첫 응답까지 걸린 시간, 기동 직후 RSS.
+
+릴리스마다 같은 명령으로 돌려 결과 JSON 을 비교한다. 각 회차는 새 프로세스로 실행하며
+중앙값을 보고한다. 무거운 모듈(cv2, numpy)이 기동 시 올라왔는지도 함께 기록한다.
+
+실행 예:
+  python bench_startup.py                         # python app.py 기준 5회
+  python bench_startup.py --server gunicorn --runs 10 --json startup.json
+  python bench_startup.py --env WM_DETECT=0
+"""
+import os, sys, time, json, socket, argparse, subprocess, statistics, tempfile, shutil
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 새 인터프리터에서 app 을 import 하고 시간·RSS·무거운 모듈 로드 여부를 JSON 한 줄로 출력
+IMPORT_PROBE = """
+import sys, time, json, resource
+t0 = time.perf_counter()
+import app
+dt = time.perf_counter() - t0
+print(json.dumps({"import_sec": dt, "maxrss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "cv2": "cv2" in sys.modules, "numpy": "numpy" in sys.modules}))
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_kib(pid: int):
+    """프로세스와 자식들의 VmRSS 합(KiB). gunicorn 은 마스터 + 워커."""
+    total = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def measure_import(env: dict, cwd: str):
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, cwd=cwd,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def measure_ready(server: str, env: dict, cwd: str, timeout: float = 60):
+    """프로세스 시작 → GET / 첫 200 까지의 시간과 그 시점 RSS."""
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(HERE, "gunicorn.conf.py"),
+               "--chdir", HERE, "app:app"]
+    else:
+        cmd = [sys.executable, os.path.join(HERE, "app.py")]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"서버가 종료됨(코드 {proc.returncode})")
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                pass
+            if time.perf_counter() - t0 > timeout:
+                raise RuntimeError("서버 응답 없음")
+            time.sleep(0.02)
+        ready = time.perf_counter() - t0
+        return {"ready_sec": ready, "rss_kib": rss_kib(proc.pid)}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    ap = argparse.ArgumentParser(description="AI-Studio 콜드 스타트·메모리 측정")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--server", choices=["python", "gunicorn"], default="python")
+    ap.add_argument("--env", nargs="*", default=[], help="앱에 넘길 추가 ENV (KEY=VALUE)")
+    ap.add_argument("--json", help="결과를 JSON 파일로도 저장")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ, PYTHONPATH=HERE, SORA_TOKEN="fake", SCRATCH_DIR=os.path.join(workdir, "scratch"),
+               OUTPUT_DIR=os.path.join(workdir, "outputs"), CLIP_CACHE_DIR="", BGM_CACHE_DIR="",
+               JOURNAL_DB="", WEB_WORKERS="1", **dict(kv.split("=", 1) for kv in args.env))
+    try:
+        imports = [measure_import(env, workdir) for _ in range(args.runs)]
+        readies = [measure_ready(args.server, env, workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    med = lambda xs: statistics.median(xs)
+    result = {
+        "server": args.server, "runs": args.runs, "python": sys.version.split()[0],
+        "import_sec": round(med([r["import_sec"] for r in imports]), 3),
+        "import_maxrss_mib": round(med([r["maxrss_kib"] for r in imports]) / 1024, 1),
+        "ready_sec": round(med([r["ready_sec"] for r in readies]), 3),
+        "ready_rss_mib": round(med([r["rss_kib"] for r in readies]) / 1024, 1),
+        "cv2_loaded": any(r["cv2"] for r in imports),
+        "numpy_loaded": any(r["numpy"] for r in imports),
+        "env": args.env,
+    }
+    print(f"{args.server:<8} import={result['import_sec']:.3f}s ({result['import_maxrss_mib']}MiB) "
+          f"ready={result['ready_sec']:.3f}s rss={result['ready_rss_mib']}MiB "
+          f"cv2={result['cv2_loaded']} numpy={result['numpy_loaded']}", flush=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
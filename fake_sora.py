@@ -0,0 +1,107 @@
+"""로컬 가짜 Sora 서버 — 실제 쿼터 없이 파이프라인 처리량을 재기 위한 대역.
+
+submit_clip / wait_done 이 쓰는 두 엔드포인트만 흉내 낸다.
+  POST /v1/videos          → {"id": ...}        (FAKE_429_RATE 확률로 429 + Retry-After)
+  GET  /v1/videos/<id>     → {"status": ..., "download_url": ...}
+  GET  /files/<name>.mp4   → ffmpeg testsrc/sine 으로 만든 합성 MP4 (Range 지원)
+
+실행: python fake_sora.py --port 9000
+앱:   SORA_BASE_URL=http://127.0.0.1:9000/v1/videos SORA_TOKEN=fake python app.py
+"""
+from flask import Flask, request, jsonify, send_from_directory, abort
+import os, time, random, subprocess, threading, uuid, argparse, tempfile
+
+app = Flask(__name__)
+
+CFG = {
+    "queue_sec":      float(os.getenv("FAKE_QUEUE_SEC", "1")),       # 대기열 지연
+    "gen_per_sec":    float(os.getenv("FAKE_GEN_PER_SEC", "0.5")),   # 영상 1초당 생성 시간
+    "jitter":         float(os.getenv("FAKE_JITTER", "0.2")),        # 지연 ±비율
+    "fail_rate":      float(os.getenv("FAKE_FAIL_RATE", "0")),       # 생성 실패(status=failed) 확률
+    "rate_429":       float(os.getenv("FAKE_429_RATE", "0")),        # 제출 시 429 확률
+    "retry_after":    int(os.getenv("FAKE_RETRY_AFTER", "1")),
+    "files_dir":      os.getenv("FAKE_FILES_DIR", os.path.join(tempfile.gettempdir(), "fake_sora_files")),
+}
+
+# 비율별 합성 영상 해상도
+SIZES = {"16:9": (1280, 720), "9:16": (720, 1280), "1:1": (720, 720)}
+
+VIDEOS = {}
+LOCK = threading.Lock()
+FILE_LOCK = threading.Lock()
+
+def synth_clip(ratio: str, duration: int):
+    """비율·길이별 합성 MP4 를 한 번만 만들어 재사용. 우하단에 가짜 워터마크를 그린다."""
+    w, h = SIZES.get(ratio, SIZES["9:16"])
+    name = f"{w}x{h}_{duration}s.mp4"
+    path = os.path.join(CFG["files_dir"], name)
+    with FILE_LOCK:
+        if not os.path.exists(path):
+            os.makedirs(CFG["files_dir"], exist_ok=True)
+            tmp = path + ".tmp.mp4"
+            subprocess.run([
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc=size={w}x{h}:rate=30:duration={duration}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+                "-vf", f"drawbox=x={int(w*0.76)}:y={int(h*0.90)}:w={int(w*0.18)}:h={int(h*0.05)}:color=white@0.8:t=fill",
+                "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k", "-shortest", "-movflags", "+faststart", tmp
+            ], check=True)
+            os.replace(tmp, path)
+    return name
+
+def _delay(base: float):
+    return max(0.0, base * random.uniform(1 - CFG["jitter"], 1 + CFG["jitter"]))
+
+@app.route("/v1/videos", methods=["POST"])
+def create():
+    if random.random() < CFG["rate_429"]:
+        resp = jsonify({"error": "rate limited"})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(CFG["retry_after"])
+        return resp
+    body = request.get_json(force=True)
+    duration = int(body.get("duration_sec") or 10)
+    now = time.time()
+    started = now + _delay(CFG["queue_sec"])
+    vid = "fake_" + uuid.uuid4().hex[:16]
+    with LOCK:
+        VIDEOS[vid] = {
+            "ratio": body.get("ratio", "9:16"), "duration": duration,
+            "started": started, "ready": started + _delay(duration * CFG["gen_per_sec"]),
+            "fail": random.random() < CFG["fail_rate"],
+        }
+    return jsonify({"id": vid, "status": "queued"})
+
+@app.route("/v1/videos/<vid>")
+def status(vid):
+    with LOCK:
+        v = VIDEOS.get(vid)
+    if v is None:
+        abort(404)
+    now = time.time()
+    if now < v["started"]:
+        return jsonify({"id": vid, "status": "queued"})
+    if now < v["ready"]:
+        return jsonify({"id": vid, "status": "in_progress",
+                        "progress": round((now - v["started"]) / max(1e-6, v["ready"] - v["started"]), 2)})
+    if v["fail"]:
+        return jsonify({"id": vid, "status": "failed", "error": "synthetic failure"})
+    name = synth_clip(v["ratio"], v["duration"])
+    return jsonify({"id": vid, "status": "completed", "download_url": f"{request.host_url}files/{name}"})
+
+@app.route("/files/<name>")
+def files(name):
+    return send_from_directory(CFG["files_dir"], name, conditional=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="로컬 가짜 Sora 서버")
+    ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "9000")))
+    ap.add_argument("--queue-sec", type=float, default=CFG["queue_sec"])
+    ap.add_argument("--gen-per-sec", type=float, default=CFG["gen_per_sec"])
+    ap.add_argument("--fail-rate", type=float, default=CFG["fail_rate"])
+    ap.add_argument("--rate-429", type=float, default=CFG["rate_429"])
+    args = ap.parse_args()
+    CFG.update(queue_sec=args.queue_sec, gen_per_sec=args.gen_per_sec,
+               fail_rate=args.fail_rate, rate_429=args.rate_429)
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
@@ -0,0 +1,26 @@
+# 운영용 gunicorn 설정: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# 작업 상태(JOBS)는 프로세스 메모리에 있으므로 기본은 프로세스 1개 + 스레드 다수.
+# 스레드마다 SSE 연결·영상 스트리밍 하나씩을 처리한다.
+workers = int(os.getenv("WEB_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "64"))
+
+# gthread 의 timeout 은 워커 하트비트 기준이라 긴 스트리밍 응답에는 영향이 없다
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+keepalive = 5
+graceful_timeout = 30
+
+# file_wrapper 응답을 os.sendfile 로 전송(zero-copy)
+sendfile = True
+
+accesslog = "-"
+errorlog = "-"
+
+def post_worker_init(worker):
+    # 워커마다 저널에서 주인 없는 미완료 작업을 이어 받는다(여러 워커가 떠도 작업마다 한 곳만)
+    from app import recover_jobs
+    recover_jobs()